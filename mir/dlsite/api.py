@@ -12,26 +12,71 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""DLsite API"""
+"""DLsite API
 
+Modules needed only for fetching and parsing (bs4, shelve,
+urllib.request) are imported where they are used, so that commands
+which never miss the cache start quickly.
+"""
+
+import collections.abc
+import contextlib
+import hashlib
+import json
 import logging
 import os
 from pathlib import Path
 import re
-import shelve
-import urllib.request
-
-import bs4
-from bs4 import BeautifulSoup
+import threading
+import time
 
+from mir.dlsite import cache
+from mir.dlsite.progress import Progress
 from mir.dlsite import workinfo
 
 logger = logging.getLogger(__name__)
 
 
-def fetch_work(rjcode: str) -> workinfo.Work:
-    """Fetch DLsite work information."""
-    page = _get_page(rjcode)
+def fetch_work(rjcode: str, resolver: 'URLResolver' = None,
+               memo: 'MutableMapping[str, Tuple[str, workinfo.Work]]' = None,
+               ) -> workinfo.Work:
+    """Fetch DLsite work information.
+
+    resolver is used to find the work's page.  If it is None, a fresh
+    URLResolver without hints is used.
+
+    memo, if given, maps RJ codes to the key of the last fetched page
+    (see _page_key()) and the work parsed from it.  If the fetched page
+    has the same key, the memoized work is returned without parsing the
+    page again.
+    """
+    page = _get_page(rjcode, resolver)
+    if memo is None:
+        return _parse_work(rjcode, page)
+    key = _page_key(page)
+    entry = memo.get(rjcode)
+    if entry is not None and entry[0] == key:
+        logger.debug('Page for %s unchanged, reusing parse', rjcode)
+        return entry[1]
+    work = _parse_work(rjcode, page)
+    memo[rjcode] = key, work
+    return work
+
+
+# Increment this when parsing changes, to invalidate memoized parses.
+_PARSER_VERSION = 1
+
+
+def _page_key(page: str) -> str:
+    """Return the memo key for a page."""
+    h = hashlib.sha256(f'{_PARSER_VERSION}\0'.encode())
+    h.update(page.encode())
+    return h.hexdigest()
+
+
+def _parse_work(rjcode: str, page: str) -> workinfo.Work:
+    """Parse DLsite work information from a page."""
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(page, 'lxml')
     work = workinfo.Work(
         rjcode=rjcode,
@@ -62,30 +107,196 @@ def fetch_work(rjcode: str) -> workinfo.Work:
     return work
 
 
-def _get_page(rjcode: str) -> str:
+def fetch_works(rjcodes: 'Iterable[str]',
+                resolver: 'URLResolver' = None,
+                fields: 'Iterable[str]' = ('name', 'maker'),
+                ) -> 'Dict[str, workinfo.Work]':
+    """Fetch DLsite work information for many works at once.
+
+    This uses DLsite's JSON product info endpoint, which returns
+    information for a batch of works in one small request.  The
+    endpoint only knows some Work fields (see _JSON_FIELDS).  fields
+    names the Work fields the caller needs; works for which the endpoint
+    lacks any of them, or whose batch request fails, are fetched with
+    fetch_work() instead.
+
+    This is a library API for callers that only need the JSON fields.
+    CachedFetcher does not use it, since cached works are used to build
+    paths and descriptions, which need fields the endpoint lacks (such
+    as series).
+
+    Returns a dict mapping RJ codes to Work instances.
+    """
+    if resolver is None:
+        resolver = URLResolver()
+    rjcodes = list(dict.fromkeys(rjcodes))
+    fields = set(fields)
+    works = {}
+    if fields <= _JSON_FIELDS:
+        for store, batch in _batch_by_store(rjcodes, _INFO_BATCH_SIZE):
+            try:
+                records = _get_info(resolver.info_url(store, batch))
+            except (OSError, ValueError) as e:
+                # URLError is an OSError, and bad JSON is a ValueError.
+                logger.warning('Cannot get info for %s works: %s', store, e)
+                continue
+            for rjcode in batch:
+                try:
+                    work = _json_to_work(rjcode, records[rjcode])
+                except (KeyError, TypeError):
+                    continue
+                if all(getattr(work, f) is not None for f in fields):
+                    works[rjcode] = work
+    for rjcode in rjcodes:
+        if rjcode not in works:
+            logger.debug('Scraping %s for missing fields', rjcode)
+            works[rjcode] = fetch_work(rjcode, resolver)
+    return works
+
+
+# Work fields that can be filled from the JSON product info endpoint.
+_JSON_FIELDS = {'rjcode', 'name', 'maker', 'age', 'images'}
+_INFO_BATCH_SIZE = 50
+
+_JSON_AGE = {
+    1: workinfo.AgeRating.AllAges,
+    2: workinfo.AgeRating.R15,
+    3: workinfo.AgeRating.R18,
+}
+
+
+def _batch_by_store(rjcodes: 'Iterable[str]', size: int) -> 'Iterable[Tuple[str, List[str]]]':
+    """Group product codes into batches from the same store."""
+    by_store = collections.defaultdict(list)
+    for rjcode in rjcodes:
+        by_store[_get_store(rjcode)].append(rjcode)
+    for store, codes in by_store.items():
+        for i in range(0, len(codes), size):
+            yield store, codes[i:i+size]
+
+
+def _get_info(url: str) -> dict:
+    """Get JSON product info records."""
+    import urllib.request
+    request = urllib.request.urlopen(url)
+    records = json.loads(request.read().decode())
+    # DLsite returns an empty list rather than an object when no
+    # products are found.
+    if not isinstance(records, dict):
+        return {}
+    return records
+
+
+def _json_to_work(rjcode: str, record: dict) -> workinfo.Work:
+    """Convert a JSON product info record to a Work."""
+    work = workinfo.Work(
+        rjcode=rjcode,
+        name=record['work_name'],
+        maker=record['maker_name'])
+    work.age = _JSON_AGE.get(record.get('age_category'))
+    image = record.get('work_image')
+    if image:
+        work.images = ['https:' + image if image.startswith('//') else image]
+    return work
+
+
+def _get_page(rjcode: str, resolver: 'URLResolver' = None) -> str:
     """Get webpage text for a work."""
-    try:
-        request = urllib.request.urlopen(_get_work_url(rjcode))
-    except urllib.error.HTTPError as e:
-        if e.code != 404:  # pragma: no cover
-            raise
-        request = urllib.request.urlopen(_get_announce_url(rjcode))
-    return request.read().decode()
+    import urllib.error
+    import urllib.request
+    if resolver is None:
+        resolver = URLResolver()
+    candidates = resolver.urls(rjcode)
+    for i, (variant, url) in enumerate(candidates):
+        try:
+            request = urllib.request.urlopen(url)
+        except urllib.error.HTTPError as e:
+            if e.code != 404 or i == len(candidates) - 1:
+                raise
+            continue
+        resolver.record(rjcode, variant)
+        return request.read().decode()
+
+
+# MIR_DLSITE_ROOT can point at a different server, such as a local fake
+# DLsite for load testing.
+_ROOT = os.environ.get('MIR_DLSITE_ROOT', 'https://www.dlsite.com/')
+_WORK_URL = '{root}{store}/work/=/product_id/{code}.html'
+_ANNOUNCE_URL = '{root}{store}/announce/=/product_id/{code}.html'
+_INFO_URL = '{root}{store}/product/info/ajax?product_id={codes}&cdn_cache_min=1'
 
+# Page variants, in the order they are tried without a hint.
+_VARIANTS = {
+    'work': _WORK_URL,
+    'announce': _ANNOUNCE_URL,
+}
 
-_ROOT = 'https://www.dlsite.com/maniax/'
-_WORK_URL = _ROOT + 'work/=/product_id/{}.html'
-_ANNOUNCE_URL = _ROOT + 'announce/=/product_id/{}.html'
+# Product code prefixes and the DLsite store that sells them.
+_STORES = {
+    'RJ': 'maniax',
+    'RE': 'ecchi-eng',
+    'VJ': 'pro',
+    'BJ': 'books',
+}
+
+
+class URLResolver:
+
+    """Resolve product codes to DLsite page URLs.
+
+    URLResolver remembers which page variant last succeeded for a
+    product in hints, a mapping from product codes to variant names, so
+    later fetches go straight to that page instead of waiting for a 404
+    on the other one.
+    """
+
+    def __init__(self, hints: 'MutableMapping[str, str]' = None,
+                 root: str = None):
+        if hints is None:
+            hints = {}
+        if root is None:
+            root = _ROOT
+        self._hints = hints
+        self._root = root
+
+    def urls(self, rjcode: str) -> 'List[Tuple[str, str]]':
+        """Return (variant, URL) pairs to try, best guess first."""
+        store = _get_store(rjcode)
+        variants = list(_VARIANTS)
+        hint = self._hints.get(rjcode)
+        if hint in variants:
+            variants.remove(hint)
+            variants.insert(0, hint)
+        return [(v, _VARIANTS[v].format(root=self._root, store=store, code=rjcode))
+                for v in variants]
+
+    def info_url(self, store: str, rjcodes: 'Iterable[str]') -> str:
+        """Return the JSON product info URL for products in a store."""
+        return _INFO_URL.format(root=self._root, store=store,
+                                codes=','.join(rjcodes))
+
+    def record(self, rjcode: str, variant: str):
+        """Record the page variant that succeeded for a product."""
+        if self._hints.get(rjcode) != variant:
+            self._hints[rjcode] = variant
+
+
+def _get_store(rjcode: str) -> str:
+    """Get the DLsite store for a product code."""
+    try:
+        return _STORES[rjcode[:2]]
+    except KeyError:
+        raise ValueError(f'unknown product code prefix {rjcode!r}')
 
 
 def _get_work_url(rjcode: str) -> str:
     """Get DLsite work URL corresponding to an RJ code."""
-    return _WORK_URL.format(rjcode)
+    return _WORK_URL.format(root=_ROOT, store=_get_store(rjcode), code=rjcode)
 
 
 def _get_announce_url(rjcode: str) -> str:
     """Get DLsite announce URL corresponding to an RJ code."""
-    return _ANNOUNCE_URL.format(rjcode)
+    return _ANNOUNCE_URL.format(root=_ROOT, store=_get_store(rjcode), code=rjcode)
 
 
 def _get_name(soup) -> str:
@@ -135,6 +346,7 @@ def _generate_images(soup) -> 'Iterable[str]':
 
 def _replace_br(elements) -> 'Iterable[str]':
     """Replace br tags with newline strings."""
+    import bs4
     for element in elements:
         if not isinstance(element, bs4.element.Tag):
             yield element
@@ -189,35 +401,231 @@ class CachedFetcher:
     """DLSite work fetcher that uses a cache.
 
     CachedFetcher does not implement fetching and needs to be passed a
-    fetching function like fetch_work().
-
-    CachedFetcher uses Python's shelve module for caching.
+    fetching function like fetch_work().  The fetching function is
+    called with the RJ code and the keyword arguments resolver, a
+    URLResolver whose hints are kept in the cache, and memo, a parse
+    memo (see fetch_work()) backed by the cache.  Only a page key is
+    stored per work for the memo; the memoized parse is the cached work.
+
+    CachedFetcher uses Python's shelve module for caching.  While open,
+    it holds an exclusive lock on the cache (see cache.lock()), since
+    shelve does not support concurrent writers, and it records when
+    each work was last used.
     """
 
     def __init__(self, path: 'PathLike', fetcher):
         self._fetcher = fetcher
         self._path = path
         self._shelf = None
+        self._resolver = None
+        self._accessed = set()
+        self._exit_stack = None
 
     def __call__(self, rjcode: str) -> workinfo.Work:
+        self._accessed.add(rjcode)
         try:
             return self._shelf[rjcode]
         except TypeError:
             raise ValueError('called unopened CachedFetcher')
         except KeyError:
-            work = self._fetcher(rjcode)
-            self._shelf[rjcode] = work
-            return work
+            return self.refresh(rjcode)
+
+    def refresh(self, rjcode: str) -> workinfo.Work:
+        """Fetch a work, replacing any cached copy."""
+        if self._shelf is None:
+            raise ValueError('called unopened CachedFetcher')
+        self._accessed.add(rjcode)
+        work = self._fetcher(rjcode, resolver=self._resolver,
+                             memo=self._memo())
+        self._shelf[rjcode] = work
+        return work
+
+    def fetch_many(self, rjcodes: 'Iterable[str]', refresh: bool = False,
+                   max_workers: int = 8,
+                   progress: 'Optional[Progress]' = None,
+                   ) -> 'Dict[str, workinfo.Work]':
+        """Get many works, fetching cache misses concurrently.
+
+        If refresh is true, all works are fetched.  The cache is only
+        touched from the calling thread.  If any fetch fails, the other
+        fetched works are still cached before the first error is
+        raised.  If progress is given, it is updated as works are
+        looked up and fetched.
+        """
+        import concurrent.futures
+        if self._shelf is None:
+            raise ValueError('called unopened CachedFetcher')
+        if progress is None:
+            progress = Progress()
+        works = {}
+        misses = []
+        for rjcode in dict.fromkeys(rjcodes):
+            self._accessed.add(rjcode)
+            if refresh:
+                misses.append(rjcode)
+                continue
+            try:
+                works[rjcode] = self._shelf[rjcode]
+            except KeyError:
+                misses.append(rjcode)
+        progress.cache_hit(len(works))
+        progress.cache_miss(len(misses))
+        progress.processed(len(works))
+        if not misses:
+            return works
+        hints = self.meta('url')
+        # Workers record hints in a plain dict, which is copied back
+        # to the cache afterward.
+        local_hints = {c: hints[c] for c in misses if c in hints}
+        resolver = URLResolver(local_hints)
+        lock = threading.Lock()
+        memo = _LockedMemo(self._memo(), lock)
+        error = None
+
+        def fetch(rjcode):
+            progress.fetch_started()
+            try:
+                return self._fetcher(rjcode, resolver=resolver, memo=memo)
+            finally:
+                progress.fetch_finished()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = {executor.submit(fetch, c): c for c in misses}
+            for future in concurrent.futures.as_completed(futures):
+                rjcode = futures[future]
+                progress.processed()
+                try:
+                    work = future.result()
+                except Exception as e:
+                    logger.debug('Error fetching %s: %s', rjcode, e)
+                    if error is None:
+                        error = e
+                    continue
+                with lock:
+                    self._shelf[rjcode] = works[rjcode] = work
+        for rjcode, hint in local_hints.items():
+            if hints.get(rjcode) != hint:
+                hints[rjcode] = hint
+        memo.flush()
+        if error is not None:
+            raise error
+        return works
+
+    def _memo(self) -> '_PageMemo':
+        return _PageMemo(self.meta('pagehash'), self._shelf)
+
+    def meta(self, namespace: str) -> 'MutableMapping[str, Any]':
+        """Return a mapping for auxiliary data stored in the cache.
+
+        Keys are stored in the cache prefixed with the namespace, so
+        they do not collide with RJ codes.
+        """
+        if self._shelf is None:
+            raise ValueError('called unopened CachedFetcher')
+        return _PrefixedMapping(self._shelf, namespace + ':')
 
     def __enter__(self):
-        self._shelf = shelve.open(os.fspath(self._path))
+        import shelve
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(cache.lock(self._path))
+            self._shelf = shelve.open(os.fspath(self._path))
+            self._exit_stack = stack.pop_all()
+        self._resolver = URLResolver(self.meta('url'))
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
     def close(self):
+        # Record access times for cache eviction (see cache.compact()).
+        now = time.time()
+        atimes = self.meta('atime')
+        for rjcode in self._accessed:
+            atimes[rjcode] = now
+        self._accessed.clear()
         self._shelf.close()
+        self._exit_stack.close()
+
+
+class _LockedMemo:
+
+    """Parse memo for worker threads.
+
+    Reads go to the underlying mapping under a lock.  Writes are
+    buffered until flush() is called from the owning thread.
+    """
+
+    def __init__(self, memo: 'MutableMapping', lock: 'threading.Lock'):
+        self._memo = memo
+        self._lock = lock
+        self._new = {}
+
+    def get(self, key, default=None):
+        try:
+            return self._new[key]
+        except KeyError:
+            pass
+        with self._lock:
+            return self._memo.get(key, default)
+
+    def __setitem__(self, key, value):
+        self._new[key] = value
+
+    def flush(self):
+        for key, value in self._new.items():
+            self._memo[key] = value
+        self._new.clear()
+
+
+class _PageMemo:
+
+    """Parse memo backed by a cache.
+
+    Only page keys are stored, in hashes.  The memoized work for an RJ
+    code is the one in works, which the caller stores itself.
+    """
+
+    def __init__(self, hashes: 'MutableMapping[str, str]',
+                 works: 'Mapping[str, workinfo.Work]'):
+        self._hashes = hashes
+        self._works = works
+
+    def get(self, rjcode, default=None):
+        try:
+            return self._hashes[rjcode], self._works[rjcode]
+        except KeyError:
+            return default
+
+    def __setitem__(self, rjcode, value):
+        key, _work = value
+        self._hashes[rjcode] = key
+
+
+class _PrefixedMapping(collections.abc.MutableMapping):
+
+    """View of the keys in a mapping that start with a prefix."""
+
+    def __init__(self, mapping, prefix: str):
+        self._mapping = mapping
+        self._prefix = prefix
+
+    def __getitem__(self, key):
+        return self._mapping[self._prefix + key]
+
+    def __setitem__(self, key, value):
+        self._mapping[self._prefix + key] = value
+
+    def __delitem__(self, key):
+        del self._mapping[self._prefix + key]
+
+    def __iter__(self):
+        n = len(self._prefix)
+        for key in list(self._mapping):
+            if key.startswith(self._prefix):
+                yield key[n:]
+
+    def __len__(self):
+        return sum(1 for _ in self)
 
 
 class _NoInfoError(ValueError):
@@ -0,0 +1,187 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cache file maintenance
+
+The cache used by CachedFetcher is a shelve file.  Its keys are RJ codes
+for cached works and namespace:key for auxiliary data (see
+CachedFetcher.meta()).  dbm files never shrink, so compact() rewrites
+the live entries into a fresh file, optionally evicting works.
+"""
+
+import contextlib
+from dataclasses import dataclass
+import glob
+import logging
+import os
+import pickle
+import time
+
+logger = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def lock(path: 'PathLike', shared: bool = False, blocking: bool = True):
+    """Lock a cache file.
+
+    CachedFetcher and compaction hold an exclusive lock, since they
+    write to the cache; snapshotting holds a shared lock.  If blocking
+    is false and the lock is held, raise BlockingIOError.  Locking is
+    skipped where fcntl is unavailable.
+    """
+    try:
+        import fcntl
+    except ImportError:  # pragma: no cover
+        yield
+        return
+    op = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    if not blocking:
+        op |= fcntl.LOCK_NB
+    with open(os.fspath(path) + '.lock', 'a') as f:
+        fcntl.flock(f, op)
+        yield
+
+
+@dataclass
+class Policy:
+    """Eviction policy for compaction.
+
+    max_works and max_bytes limit the number of works and the size of
+    their cache entries, evicting the least recently used first.
+    max_age evicts works not used for that many seconds; works never
+    used since access times were recorded are not evicted by max_age.
+    present, if not None, is the set of RJ codes to keep; other works
+    are evicted.
+    """
+    max_works: 'Optional[int]' = None
+    max_bytes: 'Optional[int]' = None
+    max_age: 'Optional[float]' = None
+    present: 'Optional[Set[str]]' = None
+
+
+@dataclass
+class Stats:
+    """Results of compaction."""
+    size_before: int
+    size_after: int
+    works_before: int
+    works_after: int
+
+    @property
+    def reclaimed(self) -> int:
+        return self.size_before - self.size_after
+
+
+def compact(path: 'PathLike', policy: Policy = None,
+            blocking: bool = True) -> Stats:
+    """Rewrite a cache file keeping only live entries.
+
+    Works are evicted according to policy, along with their auxiliary
+    entries.  File hashes for files that no longer exist are dropped.
+    The cache is locked exclusively while compacting.
+    """
+    import dbm
+    if policy is None:
+        policy = Policy()
+    path = os.fspath(path)
+    tmp = path + '.compact'
+    with lock(path, blocking=blocking):
+        size_before = _db_size(path)
+        with dbm.open(path, 'c') as old:
+            keys = [k.decode() for k in old.keys()]
+            works = {k: len(old[k]) for k in keys if ':' not in k}
+            keep = _select_works(old, works, policy, time.time())
+            _remove_db(tmp)
+            with dbm.open(tmp, 'n') as new:
+                for key in keys:
+                    value = old[key]
+                    if _keep_entry(key, value, keep):
+                        new[key] = value
+        _replace_db(tmp, path)
+        size_after = _db_size(path)
+    stats = Stats(size_before=size_before, size_after=size_after,
+                  works_before=len(works), works_after=len(keep))
+    logger.info('Compacted %s: %d -> %d bytes, %d -> %d works', path,
+                stats.size_before, stats.size_after,
+                stats.works_before, stats.works_after)
+    return stats
+
+
+def _select_works(db, works: 'Dict[str, int]', policy: Policy,
+                  now: float) -> 'Set[str]':
+    """Return the works to keep."""
+    atimes = {}
+    for rjcode in works:
+        try:
+            atimes[rjcode] = pickle.loads(db['atime:' + rjcode])
+        except KeyError:
+            pass
+    candidates = list(works)
+    if policy.present is not None:
+        candidates = [c for c in candidates if c in policy.present]
+    if policy.max_age is not None:
+        candidates = [c for c in candidates
+                      if now - atimes.get(c, now) <= policy.max_age]
+    candidates.sort(key=lambda c: atimes.get(c, 0), reverse=True)
+    keep = set()
+    total = 0
+    for rjcode in candidates:
+        if policy.max_works is not None and len(keep) >= policy.max_works:
+            break
+        total += works[rjcode]
+        if policy.max_bytes is not None and total > policy.max_bytes:
+            break
+        keep.add(rjcode)
+    return keep
+
+
+def _keep_entry(key: str, value: bytes, works: 'Set[str]') -> bool:
+    """Return True if a cache entry should be kept."""
+    namespace, sep, rest = key.partition(':')
+    if not sep:
+        return key in works
+    if namespace in ('url', 'atime', 'pagehash'):
+        return rest in works
+    if namespace in ('filehash', 'datahash'):
+        return os.path.exists(rest)
+    return True
+
+
+def _db_files(path: str) -> 'List[str]':
+    """Return the files making up a dbm database."""
+    files = [path] if os.path.exists(path) else []
+    for f in glob.glob(glob.escape(path) + '.*'):
+        suffix = f[len(path):]
+        if suffix in ('.db', '.dat', '.dir', '.bak'):
+            files.append(f)
+    return files
+
+
+def _db_size(path: str) -> int:
+    return sum(os.path.getsize(f) for f in _db_files(path))
+
+
+def _remove_db(path: str):
+    for f in _db_files(path):
+        os.unlink(f)
+
+
+def _replace_db(src: str, dst: str):
+    """Replace the dbm database at dst with the one at src."""
+    new = {f[len(src):] for f in _db_files(src)}
+    for f in _db_files(dst):
+        if f[len(dst):] not in new:
+            os.unlink(f)
+    for suffix in new:
+        os.replace(src + suffix, dst + suffix)
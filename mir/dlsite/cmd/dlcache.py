@@ -0,0 +1,103 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Maintain the DLsite work cache."""
+
+import argparse
+import logging
+from pathlib import Path
+import sys
+
+from mir.dlsite import api
+from mir.dlsite import cache
+from mir.dlsite import snapshot
+from mir.dlsite import workinfo
+from mir.dlsite.cmd import dlorg
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv):
+    args = _parse_args(argv)
+    logging.basicConfig(level='INFO')
+    return args.func(args)
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog=argv[0],
+                                     description=__doc__)
+    parser.add_argument('--cache', type=Path, default=api._CACHE,
+                        help='Cache file to use.')
+    subparsers = parser.add_subparsers(required=True, dest='command')
+
+    compact = subparsers.add_parser(
+        'compact', help='Rewrite the cache without dead space.')
+    compact.set_defaults(func=_compact)
+    compact.add_argument('--max-works', type=int,
+                         help='Keep at most this many works, evicting the'
+                         ' least recently used.')
+    compact.add_argument('--max-bytes', type=int,
+                         help='Keep at most this many bytes of works,'
+                         ' evicting the least recently used.')
+    compact.add_argument('--max-age', type=float, metavar='DAYS',
+                         help='Evict works not used for this many days.')
+    compact.add_argument('--prune-missing', type=Path, nargs='+',
+                         metavar='DIR',
+                         help='Evict works not found under these'
+                         ' directories.')
+    compact.add_argument('--no-wait', action='store_true',
+                         help='Fail instead of waiting if the cache is'
+                         ' in use.')
+
+    snap = subparsers.add_parser(
+        'snapshot', help='Write a read-only snapshot of the cached works.')
+    snap.set_defaults(func=_snapshot)
+    snap.add_argument('output', type=Path,
+                      help='Snapshot file to write.')
+    return parser.parse_args(argv[1:])
+
+
+def _compact(args) -> int:
+    policy = cache.Policy(max_works=args.max_works,
+                          max_bytes=args.max_bytes)
+    if args.max_age is not None:
+        policy.max_age = args.max_age * 86400
+    if args.prune_missing is not None:
+        policy.present = set(_find_rjcodes(args.prune_missing))
+    try:
+        stats = cache.compact(args.cache, policy, blocking=not args.no_wait)
+    except BlockingIOError:
+        logger.error('Cache %s is in use', args.cache)
+        return 1
+    print(f'Reclaimed {stats.reclaimed} bytes'
+          f' ({stats.size_before} -> {stats.size_after}),'
+          f' removed {stats.works_before - stats.works_after} works')
+    return 0
+
+
+def _snapshot(args) -> int:
+    count = snapshot.write_snapshot(args.cache, args.output)
+    print(f'Wrote {count} works to {args.output}')
+    return 0
+
+
+def _find_rjcodes(dirs: 'Iterable[Path]') -> 'Iterable[str]':
+    """Find RJ codes of works under directories."""
+    for d in dirs:
+        for path in dlorg._find_works(d):
+            yield workinfo.parse_rjcode(path.name)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,80 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Find duplicate copies of DLsite works.
+
+Work directories under the given directories are grouped by RJ code,
+and copies with identical contents are printed one per line, with a
+blank line between sets.
+"""
+
+import argparse
+import logging
+from pathlib import Path
+import sys
+
+from mir.dlsite import api
+from mir.dlsite import dupes
+from mir.dlsite.cmd import dlorg
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv):
+    args = _parse_args(argv)
+    logging.basicConfig(level='INFO')
+    found = dlorg._map_devices(lambda root: list(dlorg._find_works(root)),
+                               args.top_dirs)
+    groups = dupes.group_by_rjcode(
+        root / p for root, paths in found.items() for p in paths)
+    logger.info('Found %d works with more than one copy', len(groups))
+    # Hashing can take hours, so the cache is not kept open (and
+    # locked) meanwhile; new hashes are written back afterward.
+    with api.get_fetcher() as fetcher:
+        cached = dict(fetcher.meta('datahash'))
+    hashes = dict(cached)
+    sets = dupes.find_duplicates(groups.values(), hashes,
+                                 max_workers=args.jobs)
+    with api.get_fetcher() as fetcher:
+        stored = fetcher.meta('datahash')
+        for key, value in hashes.items():
+            if cached.get(key) != value:
+                stored[key] = value
+    for i, paths in enumerate(sets):
+        if i:
+            print()
+        for path in paths:
+            print(path)
+    return 0
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog=argv[0],
+                                     description=__doc__)
+    parser.add_argument('top_dirs', nargs='*', type=Path, metavar='top_dir',
+                        help='Directories to search.  Default the current'
+                        ' directory.')
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help='Number of files to hash concurrently.')
+    args = parser.parse_args(argv[1:])
+    if not args.top_dirs:
+        args.top_dirs = [Path.cwd()]
+    overlap = dlorg._find_overlap(args.top_dirs)
+    if overlap is not None:
+        parser.error('directories overlap: %s and %s' % overlap)
+    return args
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
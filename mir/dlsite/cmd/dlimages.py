@@ -0,0 +1,61 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Download DLsite work images into a local store.
+
+RJ codes are taken from the arguments, or from stdin if none are given.
+"""
+
+import argparse
+import logging
+from pathlib import Path
+import sys
+
+from mir.dlsite import api
+from mir.dlsite import images
+from mir.dlsite import workinfo
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv):
+    args = _parse_args(argv)
+    logging.basicConfig(level='INFO')
+    rjcodes = args.rjcodes
+    if not rjcodes:
+        rjcodes = [code for _offset, code in workinfo.find_rjcodes(sys.stdin.read())]
+    with api.get_fetcher() as fetcher:
+        works = [fetcher(rjcode) for rjcode in rjcodes]
+    if args.store is None:
+        store = images.get_store()
+    else:
+        store = images.ImageStore(args.store)
+    with store:
+        count = store.download(works, max_workers=args.jobs)
+    logger.info('Downloaded %d images', count)
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog=argv[0],
+                                     description=__doc__)
+    parser.add_argument('rjcodes', nargs='*', type=workinfo.parse_rjcode)
+    parser.add_argument('-s', '--store', type=Path,
+                        help='Image store directory.')
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help='Number of concurrent downloads.')
+    return parser.parse_args(argv[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
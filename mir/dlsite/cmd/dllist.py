@@ -15,39 +15,84 @@
 """For each input line, look for rjcode and fetch dlsite info."""
 
 import argparse
+import itertools
+from pathlib import Path
 import sys
 
 from mir.dlsite import api
+from mir.dlsite import daemon
+from mir.dlsite import progress
+from mir.dlsite import snapshot
 from mir.dlsite import workinfo
 
+_BATCH_SIZE = 100
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--no-info', action="store_true",
                         help="Do not fetch info; print RJ code only.")
+    parser.add_argument('-i', '--ignore-case', action='store_true',
+                        help="Match RJ codes regardless of case.")
+    parser.add_argument('--prefix', action='append', dest='prefixes',
+                        help="Product code prefix to look for (default"
+                        " those of all DLsite stores).  May be given more"
+                        " than once.")
+    parser.add_argument('--progress', choices=('text', 'json'),
+                        help="Report progress on stderr as text or JSON"
+                        " lines.")
+    parser.add_argument('--snapshot', type=Path, metavar='FILE',
+                        help="Look up works in a cache snapshot (see"
+                        " dlcache snapshot) instead of the cache.")
     args = parser.parse_args()
+    kwargs = {}
+    if args.prefixes:
+        kwargs['prefixes'] = args.prefixes
+    if args.prefixes and not args.no_info:
+        unknown = [p for p in args.prefixes if p.upper() not in api._STORES]
+        if unknown:
+            parser.error(f'unknown product code prefix: {unknown[0]}'
+                         ' (only --no-info supports it)')
 
+    codes = _scan_stdin(
+        ignore_case=args.ignore_case,
+        first_per_line=True,
+        **kwargs)
     if args.no_info:
-        printer = _simple_printer
+        for _offset, rjcode in codes:
+            print(rjcode)
+        return
+    report = None
+    if args.progress is not None:
+        report = progress.get_reporter(args.progress, 'dllist')
+    p = progress.Progress(report)
+    if args.snapshot is None:
+        fetcher = daemon.get_fetcher()
     else:
-        printer = _info_printer
-
-    for line in sys.stdin:
-        try:
-            rjcode = workinfo.parse_rjcode(line)
-        except ValueError:
-            continue
-        printer(rjcode)
+        fetcher = snapshot.SnapshotFetcher(args.snapshot, api.fetch_work)
+    with fetcher:
+        for batch in _batches((c for _offset, c in codes), _BATCH_SIZE):
+            works = fetcher.fetch_many(batch, progress=p)
+            for rjcode in batch:
+                print(workinfo.work_filename(works[rjcode]))
+    p.close()
 
 
-def _simple_printer(rjcode: str):
-    print(rjcode)
+def _batches(it: 'Iterable[T]', n: int) -> 'Iterable[List[T]]':
+    it = iter(it)
+    while True:
+        batch = list(itertools.islice(it, n))
+        if not batch:
+            return
+        yield batch
 
 
-def _info_printer(rjcode: str):
-    with api.get_fetcher() as fetcher:
-        work = fetcher(rjcode)
-        print(workinfo.work_filename(work))
+def _scan_stdin(**kwargs) -> 'Iterable[Tuple[int, str]]':
+    """Find RJ codes in stdin in bulk."""
+    stdin = getattr(sys.stdin, 'buffer', None)
+    if stdin is None:
+        return workinfo.find_rjcodes(sys.stdin.read(), **kwargs)
+    return workinfo.scan_rjcodes_file(stdin, **kwargs)
 
 
 if __name__ == '__main__':
@@ -17,28 +17,121 @@
 import argparse
 import logging
 import os
+import sys
 
-from mir.dlsite import api
+from mir.dlsite import daemon
 from mir.dlsite import workinfo
 
+logger = logging.getLogger(__name__)
+
 
 def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('file')
-    parser.add_argument('rjcode', nargs='?', default=None,
-                        type=workinfo.parse_rjcode)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('files', nargs='*', metavar='file',
+                        help='File to rename, optionally followed by its'
+                        ' RJ code.  With --batch, files to rename.')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='Rename every file given, each next to the'
+                        ' original.')
+    parser.add_argument('-0', '--null', action='store_true',
+                        help='Read NUL separated file names from stdin.'
+                        '  Implies --batch.')
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help='Number of concurrent lookups in batch mode.')
     args = parser.parse_args()
     logging.basicConfig(level='DEBUG')
 
-    if args.rjcode is None:
-        rjcode = workinfo.parse_rjcode(args.file)
+    if args.batch or args.null:
+        files = list(args.files)
+        if args.null:
+            files.extend(f for f in sys.stdin.read().split('\0') if f)
+        return _batch(files, args.jobs)
+
+    if not 1 <= len(args.files) <= 2:
+        parser.error('expected a file and an optional RJ code')
+    file = args.files[0]
+    if len(args.files) == 2:
+        rjcode = workinfo.parse_rjcode(args.files[1])
     else:
-        rjcode = args.rjcode
+        rjcode = workinfo.parse_rjcode(file)
 
-    with api.get_fetcher() as fetcher:
+    with daemon.get_fetcher() as fetcher:
         work = fetcher(rjcode)
-    os.rename(args.file, workinfo.work_filename(work))
+    os.rename(file, workinfo.work_filename(work))
+
+
+def _batch(files: 'List[str]', jobs: int) -> int:
+    """Rename many files, returning an exit status."""
+    rjcodes = {}
+    for file in files:
+        try:
+            rjcodes[file] = workinfo.parse_rjcode(os.path.basename(file))
+        except ValueError:
+            logger.warning('No RJ code in %s, skipping', file)
+    with daemon.get_fetcher() as fetcher:
+        works = _fetch_works(fetcher, list(dict.fromkeys(rjcodes.values())),
+                             jobs)
+    status = 0
+    pairs = []
+    for file, rjcode in rjcodes.items():
+        if rjcode not in works:
+            logger.warning('No info for %s, skipping', file)
+            status = 1
+            continue
+        pairs.append((file, workinfo.work_filename(works[rjcode])))
+    renames = _plan_renames(pairs)
+    collisions = _find_collisions(renames)
+    if collisions:
+        for target, sources in collisions.items():
+            logger.error('Cannot rename %s to %s', ', '.join(sources), target)
+        return 1
+    for old, new in renames:
+        logger.debug('Renaming %s to %s', old, new)
+        os.rename(old, new)
+    return status
+
+
+def _fetch_works(fetcher, rjcodes: 'List[str]',
+                 jobs: int) -> 'Dict[str, workinfo.Work]':
+    """Look up works, leaving out those that cannot be found.
+
+    If the batch lookup fails, works are looked up one at a time, so
+    those fetched by the batch come from the cache.
+    """
+    try:
+        return fetcher.fetch_many(rjcodes, max_workers=jobs)
+    except Exception as e:
+        logger.debug('Batch lookup failed: %s', e)
+    works = {}
+    for rjcode in rjcodes:
+        try:
+            works[rjcode] = fetcher(rjcode)
+        except Exception as e:
+            logger.warning('Cannot look up %s: %s', rjcode, e)
+    return works
+
+
+def _plan_renames(pairs: 'Iterable[Tuple[str, str]]') -> 'List[Tuple[str, str]]':
+    """Plan renames of files to new names in the same directory."""
+    renames = []
+    for file, name in pairs:
+        new = os.path.join(os.path.dirname(file), name)
+        if os.path.normpath(file) != os.path.normpath(new):
+            renames.append((file, new))
+    return renames
+
+
+def _find_collisions(renames: 'List[Tuple[str, str]]') -> 'Dict[str, List[str]]':
+    """Find rename targets that are shared or already exist.
+
+    Returns a dict mapping colliding targets to their sources.
+    """
+    by_target = {}
+    for old, new in renames:
+        by_target.setdefault(os.path.normpath(new), []).append(old)
+    return {target: sources for target, sources in by_target.items()
+            if len(sources) > 1 or os.path.lexists(target)}
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
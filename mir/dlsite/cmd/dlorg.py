@@ -15,48 +15,332 @@
 """Organize DLsite works."""
 
 import argparse
+import collections
+import concurrent.futures
+import hashlib
 import logging
 import logging.config
 import os
 from pathlib import Path
 import sys
+import threading
+import time
 
 from mir.dlsite import api
+from mir.dlsite import view
+from mir.dlsite import watch
 from mir.dlsite import workinfo
+from mir.dlsite.progress import Progress
+from mir.dlsite.progress import get_reporter
 
 logger = logging.getLogger(__name__)
 
 
 def main(argv):
     args = _parse_args(argv)
-    _configure_logging()
-    paths = _find_works(args.top_dir, recursive=args.all)
+    # Per-work debug logging is too noisy and slow for large runs
+    # with progress reports.
+    _configure_logging('DEBUG' if args.progress is None else 'INFO')
+    roots = _map_devices(lambda root: _find_root_works(args, root),
+                         args.top_dirs)
+    report = None
+    if args.progress is not None:
+        report = get_reporter(args.progress, 'dlorg')
+    with api.get_fetcher() as fetcher:
+        p = Progress(report, total=sum(map(len, roots.values())),
+                     phase='fetch')
+        _organize(args, fetcher, roots, progress=p)
+        p.close()
+    if not args.dry_run and args.view is None:
+        logger.info('Removing empty dirs')
+        _map_devices(_remove_empty_dirs, args.top_dirs)
+    if args.watch:
+        top_dir, = args.top_dirs
+        with watch.get_watcher(top_dir, recursive=args.all,
+                               poll_interval=args.poll_interval) as watcher:
+            _watch(args, api.get_fetcher, watcher)
+
+
+def _find_root_works(args, top_dir: 'Path') -> 'List[Path]':
+    paths = _find_works(top_dir, recursive=args.all)
     if not args.all:
         paths = _filter_shallow_paths(paths)
-    with api.get_fetcher() as fetcher:
-        for path in paths:
-            _do_one(args, fetcher, path)
+    return list(paths)
+
+
+def _map_devices(func, roots: 'Iterable[Path]') -> 'Dict[Path, Any]':
+    """Call func on each root, with one worker thread per device.
+
+    Roots on the same device are done one after another, so that a disk
+    is not made to seek between them.  Returns a dict mapping roots to
+    results.
+    """
+    devices = collections.defaultdict(list)
+    for root in roots:
+        devices[os.stat(root).st_dev].append(root)
+
+    def run(roots):
+        return {root: func(root) for root in roots}
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(len(devices) or 1) as executor:
+        for result in executor.map(run, devices.values()):
+            results.update(result)
+    return results
+
+
+def _organize(args, fetcher, roots: 'Mapping[Path, Iterable[Path]]',
+              prune: bool = True,
+              progress: 'Optional[Progress]' = None,
+              ) -> 'Dict[Path, Dict[Path, Path]]':
+    """Organize works, returning their new paths.
+
+    roots maps top directories to paths of works relative to them.
+    Returns a dict mapping each root to a dict mapping the paths of the
+    works organized to their new paths; works whose info cannot be
+    found, or that would collide with another work, are left out.
+
+    Work info for all roots is fetched first in one batch, and the whole
+    layout is planned in memory before touching the filesystem.  Each
+    root is organized within itself, with one worker per device.  With
+    args.view, works from all roots are linked into the view instead of
+    moved, and prune controls whether view links to other works are
+    removed.
+
+    progress, if given, is passed to fetch_many() and then moved
+    through the rename (or link) and describe phases.
+    """
+    if progress is None:
+        progress = Progress()
+    rjcodes = {(root, p): workinfo.parse_rjcode(p.name)
+               for root, paths in roots.items() for p in paths}
+    _log_shared_works(rjcodes)
+    works = _fetch_works(args, fetcher, rjcodes.values(), progress)
+    for (root, p), rjcode in rjcodes.items():
+        if rjcode not in works:
+            logger.warning('Skipping %s: no work info', root / p)
+    rjcodes = {k: c for k, c in rjcodes.items() if c in works}
+    roots = {root: [p for p in paths if (root, p) in rjcodes]
+             for root, paths in roots.items()}
+    if args.view is None:
+        plans = {root: _plan_layout(args, {p: works[rjcodes[root, p]]
+                                           for p in paths})
+                 for root, paths in roots.items()}
+        progress.start_phase('rename', sum(map(len, plans.values())))
+        done = _map_devices(
+            lambda root: _apply_plan(args, root, plans[root], progress),
+            plans)
+        done = {root: dict(zip(plans[root], done[root])) for root in plans}
+        jobs = [(works[rjcodes[root, old]], root / new)
+                for root, moved in done.items()
+                for old, new in moved.items()]
+    else:
+        plan = _plan_layout(args, {root / p: works[c]
+                                   for (root, p), c in rjcodes.items()})
+        progress.start_phase('link', len(plan))
+        _link_view(args, plan, prune=prune, progress=progress)
+        done = {root: {p: p for p in paths if root / p in plan}
+                for root, paths in roots.items()}
+        jobs = [(works[c], root / p) for (root, p), c in rjcodes.items()]
+    if args.add_descriptions and not args.dry_run:
+        logger.info('Adding description files')
+        _write_dlsite_files(jobs, fetcher.meta('filehash'),
+                            refresh=args.refresh, progress=progress)
+    return done
+
+
+def _fetch_works(args, fetcher, rjcodes: 'Iterable[str]',
+                 progress: 'Progress') -> 'Dict[str, workinfo.Work]':
+    """Look up works, leaving out those that cannot be found.
+
+    If the batch lookup fails, works are looked up one at a time, so
+    those fetched by the batch come from the cache.
+    """
+    rjcodes = list(rjcodes)
+    try:
+        return fetcher.fetch_many(rjcodes, refresh=args.refresh,
+                                  progress=progress)
+    except Exception as e:
+        logger.debug('Batch lookup failed: %s', e)
+    works = {}
+    for rjcode in dict.fromkeys(rjcodes):
+        try:
+            works[rjcode] = fetcher(rjcode)
+        except Exception as e:
+            logger.warning('Cannot look up %s: %s', rjcode, e)
+    return works
+
+
+def _log_shared_works(rjcodes: 'Mapping[Tuple[Path, Path], str]'):
+    """Log works found under more than one root."""
+    roots = collections.defaultdict(set)
+    for (root, _path), rjcode in rjcodes.items():
+        roots[rjcode].add(root)
+    for rjcode, found in roots.items():
+        if len(found) > 1:
+            logger.info('%s is under several roots: %s', rjcode,
+                        ', '.join(sorted(map(str, found))))
+
+
+def _plan_layout(args, works: 'Mapping[Path, Work]') -> 'Dict[Path, Path]':
+    plan, collisions = workinfo.plan_layout(works, args.layout)
+    for new, olds in collisions.items():
+        logger.warning('Skipping duplicate works %s (all would be %s)',
+                       ', '.join(map(str, olds[1:])), new)
+    return plan
+
+
+def _apply_plan(args, top_dir: 'Path', plan: 'Mapping[Path, Path]',
+                progress: 'Progress') -> 'List[Path]':
+    """Move the works under a root, returning their new paths."""
+    done = []
+    for old, new in plan.items():
+        done.append(_apply(args, top_dir, old, new))
+        progress.processed()
     if not args.dry_run:
-        logger.info('Removing empty dirs')
-        _remove_empty_dirs(args.top_dir)
+        logger.info('Renamed %d of %d works in %s',
+                    sum(old != new for old, new in zip(plan, done)),
+                    len(done), top_dir)
+    return done
+
+
+def _watch(args, get_fetcher, watcher):
+    """Organize new works as they appear, until interrupted.
+
+    Work info is fetched as soon as a work directory appears, but the
+    work is organized only after it has been quiet for args.debounce
+    seconds, so that downloads can finish first.  Works that could not
+    be organized are tried again after _RETRY_DELAY seconds.
+    get_fetcher creates an unopened fetcher; it is only kept open while
+    there is work to do, so other commands can use the cache in between.
+    """
+    top_dir, = args.top_dirs
+    logger.info('Watching %s', top_dir)
+    debouncer = watch.Debouncer(args.debounce)
+    try:
+        while True:
+            events = watcher.events(timeout=min(args.debounce, 1))
+            new = [p for p in events if debouncer.add(p, time.monotonic())]
+            if new:
+                with get_fetcher() as fetcher:
+                    for path in new:
+                        _prefetch(fetcher, path)
+            ready = []
+            for p in debouncer.ready(time.monotonic()):
+                if not (top_dir / p).is_dir():
+                    continue
+                # Watchers may miss writes deep inside a work.
+                if watch.recently_modified(top_dir / p, args.debounce):
+                    debouncer.add(p, time.monotonic())
+                    continue
+                ready.append(p)
+            if not ready:
+                continue
+            try:
+                with get_fetcher() as fetcher:
+                    done = _organize(args, fetcher, {top_dir: ready},
+                                     prune=False)[top_dir]
+            except Exception:
+                logger.exception('Error organizing %s', ready)
+                done = {}
+            # Adding with a later time delays when paths are ready.
+            retry = time.monotonic() + _RETRY_DELAY
+            for p in ready:
+                if p not in done:
+                    debouncer.add(p, retry)
+            if not args.dry_run:
+                for old, new in done.items():
+                    if old != new:
+                        _remove_empty_parents(top_dir, old)
+    except KeyboardInterrupt:
+        pass
+
+
+def _link_view(args, plan: 'Mapping[Path, Path]', prune: bool,
+               progress: 'Optional[Progress]' = None):
+    """Link works into the view directory.
+
+    plan maps work directories to their paths in the view.
+    """
+    targets = {new: old for old, new in plan.items()}
+    stats = view.update_view(args.view, targets, mode=args.link,
+                             prune=prune, dry_run=args.dry_run,
+                             progress=progress)
+    logger.info('View links: %d created, %d removed, %d unchanged',
+                stats.created, stats.removed, stats.unchanged)
+
+
+def _prefetch(fetcher, path: 'Path'):
+    """Fetch work info for a path ahead of organizing it."""
+    logger.info('Found %s', path)
+    try:
+        _get_path_work(fetcher, path)
+    except Exception:
+        logger.exception('Error fetching info for %s', path)
 
 
 def _parse_args(argv):
     parser = argparse.ArgumentParser(prog=argv[0],
                                      description=__doc__)
-    parser.add_argument('top_dir', nargs='?', default=Path.cwd(),
-                        type=Path)
+    parser.add_argument('top_dirs', nargs='*', type=Path, metavar='top_dir',
+                        help='Directories to organize, for example one'
+                        ' per disk.  Default the current directory.')
     parser.add_argument('-n', '--dry-run', action='store_true')
     parser.add_argument('-a', '--all', action='store_true')
     parser.add_argument('-d', '--add-descriptions', action='store_true')
-    return parser.parse_args(argv[1:])
-
-
-def _configure_logging():
+    parser.add_argument('-r', '--refresh', action='store_true',
+                        help='Refetch work info and rewrite description'
+                        ' files whose contents changed.')
+    parser.add_argument('-l', '--layout', type=workinfo.get_layout,
+                        default=workinfo.work_path,
+                        help='Layout to organize works in: one of'
+                        f' {", ".join(workinfo.LAYOUTS)}, or a path template'
+                        ' such as "{maker}/{series}/{rjcode} {name}".'
+                        ' Default maker.')
+    parser.add_argument('--view', type=Path, metavar='DIR',
+                        help='Build the organized layout as links in DIR'
+                        ' instead of moving works.')
+    parser.add_argument('--link', choices=[view.SYMLINK, view.HARDLINK],
+                        default=view.SYMLINK,
+                        help='Kind of links to use with --view.')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='Keep running and organize new works as'
+                        ' they appear.')
+    parser.add_argument('--debounce', type=float, default=5,
+                        help='Seconds a new work must be left alone before'
+                        ' it is organized in watch mode.')
+    parser.add_argument('--poll-interval', type=float, default=10,
+                        help='Seconds between rescans in watch mode when'
+                        ' inotify is not available.')
+    parser.add_argument('--progress', choices=('text', 'json'),
+                        help='Report progress on stderr as text or JSON'
+                        ' lines, and log less.')
+    args = parser.parse_args(argv[1:])
+    if not args.top_dirs:
+        args.top_dirs = [Path.cwd()]
+    overlap = _find_overlap(args.top_dirs)
+    if overlap is not None:
+        parser.error('directories overlap: %s and %s' % overlap)
+    if args.watch and len(args.top_dirs) > 1:
+        parser.error('--watch takes only one directory')
+    return args
+
+
+def _find_overlap(roots: 'Iterable[Path]') -> 'Optional[Tuple[Path, Path]]':
+    """Return two roots of which one contains the other, if any."""
+    resolved = [p.resolve() for p in roots]
+    for i, a in enumerate(resolved):
+        for b in resolved[i+1:]:
+            if a == b or a in b.parents or b in a.parents:
+                return a, b
+    return None
+
+
+def _configure_logging(level: str = 'DEBUG'):
     logging.config.dictConfig({
         'version': 1,
         'root': {
-            'level': 'DEBUG',
+            'level': level,
             'handlers': ['default'],
         },
         'handlers': {
@@ -81,42 +365,57 @@ def _filter_shallow_paths(paths: 'Iterable[Path]'):
             yield p
 
 
-def _find_works(top_dir: 'PathLike') -> 'Iterable[Path]':
+def _find_works(top_dir: 'PathLike', recursive: bool = True) -> 'Iterable[Path]':
     """Find DLsite works.
 
-    Yield Path instances to work directories, relative to top_dir.
+    Yield Path instances to work directories, relative to top_dir.  If
+    recursive is false, only look directly inside top_dir.
     """
     for dirpath, dirnames, _filenames in os.walk(top_dir):
         work_dirnames = [n for n in dirnames if workinfo.contains_rjcode(n)]
         yield from (Path(dirpath, n).relative_to(top_dir) for n in work_dirnames)
         for n in work_dirnames:
             dirnames.remove(n)
+        if not recursive:
+            dirnames.clear()
 
 
 def _remove_empty_dirs(top_dir: 'PathLike'):
+    """Remove empty directories under top_dir, but not top_dir itself."""
+    top_dir = os.fspath(top_dir)
     for dirpath, dirnames, filenames in os.walk(top_dir, topdown=False):
-        if not os.listdir(dirpath):
+        if dirpath != top_dir and not os.listdir(dirpath):
             os.rmdir(dirpath)
 
 
-def _do_one(args, fetcher, path):
-    new_path = _calculate_new_path(fetcher, path)
-    if args.dry_run:
-        if path != new_path:
-            logger.info('Would rename %s to %s', path, new_path)
-        return
-    if path != new_path:
-        _rename(args.top_dir, path, new_path)
-        path = new_path
-    if args.add_descriptions:
-        logger.info('Adding description files for %s', path)
-        _add_dlsite_files(fetcher, path)
+def _remove_empty_parents(top_dir: 'Path', path: 'Path'):
+    """Remove empty directories above a path, up to top_dir."""
+    for parent in path.parents:
+        if parent == Path():
+            break
+        try:
+            (top_dir / parent).rmdir()
+        except OSError:
+            break
+
 
+def _apply(args, top_dir: 'Path', path: 'Path', new_path: 'Path') -> 'Path':
+    """Move one work to its planned path, returning its new path.
 
-def _calculate_new_path(fetcher, path: 'Path') -> 'Path':
-    """Find rename operation to organize work."""
-    work = _get_path_work(fetcher, path)
-    return workinfo.work_path(work)
+    If something already exists at the new path, for example the same
+    work organized earlier, the work is left where it is.
+    """
+    if path == new_path:
+        return path
+    if os.path.lexists(top_dir / new_path):
+        logger.warning('Not renaming %s, %s already exists',
+                       top_dir / path, top_dir / new_path)
+        return path
+    if args.dry_run:
+        logger.info('Would rename %s to %s', path, new_path)
+        return path
+    _rename(top_dir, path, new_path)
+    return new_path
 
 
 def _rename(top_dir: 'Path', old: 'Path', new: 'Path'):
@@ -127,30 +426,70 @@ def _rename(top_dir: 'Path', old: 'Path', new: 'Path'):
     old.rename(new)
 
 
+_RETRY_DELAY = 60
 _DESC_FILE = 'dlsite-description.txt'
 _TRACK_FILE = 'dlsite-tracklist.txt'
 
 
-def _add_dlsite_files(fetcher, path: 'Path'):
-    """Add dlsite information files to a work."""
-    work = _get_path_work(fetcher, path)
-    _add_desc_file(work, path)
-    _add_track_file(work, path)
+def _write_dlsite_files(jobs: 'Iterable[Tuple[Work, Path]]',
+                        hashes: 'MutableMapping[str, str]',
+                        refresh: bool = False,
+                        max_workers: int = 8,
+                        progress: 'Optional[Progress]' = None) -> int:
+    """Write dlsite information files for works in a thread pool.
 
+    jobs are pairs of works and their directories.  hashes maps file
+    paths to the hash of the contents last written there.  Existing
+    files are left alone, unless refresh is true, in which case files
+    whose new contents differ from the recorded hash are rewritten.
+    If progress is given, a describe phase counting files written is
+    started on it.
 
-def _add_desc_file(work, path: 'Path'):
-    desc_file = path / _DESC_FILE
-    if not desc_file.exists() and work.description is not None:
-        logger.info('Adding %s', desc_file)
-        desc_file.write_text(work.description)
-
-
-def _add_track_file(work, path: 'Path'):
-    track_file = path / _TRACK_FILE
-    if not track_file.exists() and work.tracklist is not None:
-        logger.info('Adding %s', track_file)
-        tl = ''.join(f'{t.name} {t.text}\n' for t in work.tracklist)
-        track_file.write_text(tl)
+    Returns the number of files written.
+    """
+    writes = []
+    for work, path in jobs:
+        for name, text in _dlsite_files(work):
+            file = path / name
+            key = os.fspath(file.absolute())
+            digest = hashlib.sha256(text.encode()).hexdigest()
+            if file.exists():
+                if not refresh or hashes.get(key) == digest:
+                    continue
+            writes.append((file, text, key, digest))
+    if progress is None:
+        progress = Progress()
+    progress.start_phase('describe', len(writes))
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = {executor.submit(_atomic_write, file, text): (key, digest)
+                   for file, text, key, digest in writes}
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+            key, digest = futures[future]
+            hashes[key] = digest
+            progress.processed()
+    return len(writes)
+
+
+def _dlsite_files(work) -> 'Iterable[Tuple[str, str]]':
+    """Generate names and contents of dlsite information files."""
+    if work.description is not None:
+        yield _DESC_FILE, work.description
+    if work.tracklist is not None:
+        yield _TRACK_FILE, ''.join(f'{t.name} {t.text}\n' for t in work.tracklist)
+
+
+def _atomic_write(path: 'Path', text: str):
+    """Write a text file atomically."""
+    logger.debug('Writing %s', path)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}')
+    try:
+        with open(tmp, 'x') as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
 
 
 def _get_path_work(fetcher, path: 'Path') -> 'workinfo.Work':
@@ -0,0 +1,54 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Serve DLsite work lookups for dlmv and dllist over a Unix socket."""
+
+import argparse
+import logging
+import os
+from pathlib import Path
+import signal
+import sys
+
+from mir.dlsite import api
+from mir.dlsite import daemon
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv):
+    args = _parse_args(argv)
+    logging.basicConfig(level='INFO')
+    daemon.warm_up()
+    # Turn SIGTERM into a normal exit so the socket gets cleaned up.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with daemon.Server(args.socket, api.get_fetcher) as server:
+        logger.info('Listening on %s', args.socket)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(args.socket)
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog=argv[0],
+                                     description=__doc__)
+    parser.add_argument('-s', '--socket', type=Path, default=daemon._SOCKET)
+    return parser.parse_args(argv[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,212 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""DLsite fetcher daemon
+
+The daemon answers work lookups over a Unix socket, saving clients the
+cost of starting up and importing the page parser.  The cache is only
+opened while a request is handled, so other processes can still use and
+compact it.  The protocol is one JSON object per line: clients send
+{"rjcode": ...} and the daemon replies with {"work": ...} or
+{"error": ...}.  For batches, clients send {"rjcodes": [...]} and the
+daemon replies with {"works": {rjcode: ...}} or {"error": ...}.
+"""
+
+import dataclasses
+import json
+import logging
+import os
+from pathlib import Path
+import socket
+import socketserver
+import threading
+
+from mir.dlsite import api
+from mir.dlsite import workinfo
+
+logger = logging.getLogger(__name__)
+
+_SOCKET = Path(os.environ.get('XDG_RUNTIME_DIR')
+               or Path.home() / '.cache') / 'mir.dlsite.sock'
+
+
+def get_fetcher():
+    """Create a fetcher using the daemon if it is running.
+
+    Falls back to api.get_fetcher() if the daemon cannot be reached.
+    """
+    try:
+        return RemoteFetcher(_connect(_SOCKET))
+    except OSError:
+        return api.get_fetcher()
+
+
+class RemoteFetcher:
+
+    """DLSite work fetcher that asks the daemon.
+
+    RemoteFetcher can be used like CachedFetcher.
+    """
+
+    def __init__(self, sock: 'socket.socket'):
+        self._sock = sock
+        self._file = sock.makefile('rwb')
+
+    def __call__(self, rjcode: str) -> workinfo.Work:
+        reply = self._request({'rjcode': rjcode})
+        return _work_from_dict(reply['work'])
+
+    def fetch_many(self, rjcodes: 'Iterable[str]', refresh: bool = False,
+                   max_workers: int = 8,
+                   progress: 'Optional[Progress]' = None,
+                   ) -> 'Dict[str, workinfo.Work]':
+        """Get many works in one request.
+
+        The daemon fetches cache misses concurrently; refresh and
+        max_workers are passed along to it.  Cache hits are not known
+        here, so progress only counts the request and processed works.
+        """
+        if progress is not None:
+            progress.fetch_started()
+        try:
+            reply = self._request({'rjcodes': list(rjcodes),
+                                   'refresh': refresh,
+                                   'max_workers': max_workers})
+        finally:
+            if progress is not None:
+                progress.fetch_finished()
+        works = {k: _work_from_dict(v) for k, v in reply['works'].items()}
+        if progress is not None:
+            progress.processed(len(works))
+        return works
+
+    def _request(self, request: dict) -> dict:
+        self._file.write(json.dumps(request).encode() + b'\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise RemoteError('daemon closed connection')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise RemoteError(reply['error'])
+        return reply
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+class RemoteError(Exception):
+    """Error reported by the daemon."""
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+
+    """Daemon server answering lookups with a fetcher.
+
+    get_fetcher is called to create an unopened fetcher, such as
+    api.get_fetcher(), for each request.  The fetcher is closed when the
+    request is done, so the server does not hold the cache lock between
+    requests.  Lookups are serialized, since CachedFetcher is not thread
+    safe.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: 'PathLike', get_fetcher):
+        self.get_fetcher = get_fetcher
+        self.lock = threading.Lock()
+        _remove_stale_socket(path)
+        super().__init__(os.fspath(path), _Handler)
+
+    def lookup(self, rjcode: str) -> workinfo.Work:
+        with self.lock, self.get_fetcher() as fetcher:
+            return fetcher(rjcode)
+
+    def lookup_many(self, rjcodes: 'List[str]', **kwargs) -> 'Dict[str, workinfo.Work]':
+        with self.lock, self.get_fetcher() as fetcher:
+            return fetcher.fetch_many(rjcodes, **kwargs)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self._handle_request(json.loads(line))
+            except Exception as e:
+                logger.exception('Error handling %r', line)
+                reply = {'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+    def _handle_request(self, request: dict) -> dict:
+        if 'rjcodes' in request:
+            works = self.server.lookup_many(
+                request['rjcodes'],
+                refresh=request.get('refresh', False),
+                max_workers=request.get('max_workers', 8))
+            return {'works': {k: _work_to_dict(v) for k, v in works.items()}}
+        work = self.server.lookup(request['rjcode'])
+        return {'work': _work_to_dict(work)}
+
+
+def warm_up():
+    """Import and exercise the page parser ahead of time."""
+    from bs4 import BeautifulSoup
+    BeautifulSoup('<html></html>', 'lxml')
+
+
+def _connect(path: 'PathLike') -> 'socket.socket':
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(os.fspath(path))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _remove_stale_socket(path: 'PathLike'):
+    """Remove a socket file left behind by a daemon that is not running."""
+    try:
+        _connect(path).close()
+    except FileNotFoundError:
+        return
+    except ConnectionRefusedError:
+        logger.info('Removing stale socket %s', path)
+        os.unlink(path)
+        return
+    raise OSError(f'daemon already running on {path}')
+
+
+def _work_to_dict(work: workinfo.Work) -> dict:
+    d = dataclasses.asdict(work)
+    if work.age is not None:
+        d['age'] = work.age.name
+    return d
+
+
+def _work_from_dict(d: dict) -> workinfo.Work:
+    d = dict(d)
+    if d['age'] is not None:
+        d['age'] = workinfo.AgeRating[d['age']]
+    if d['tracklist'] is not None:
+        d['tracklist'] = [workinfo.Track(**t) for t in d['tracklist']]
+    return workinfo.Work(**d)
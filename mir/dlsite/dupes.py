@@ -0,0 +1,183 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Duplicate work detection
+
+Copies of a work are found by RJ code and then compared by contents.
+File sizes are compared first, and files are only hashed when every
+file in two copies has the same size.  Hashes are kept in a mapping
+keyed by path and are reused while the file's size and mtime are
+unchanged, so later runs only hash new or changed files.
+"""
+
+import collections
+import concurrent.futures
+from dataclasses import dataclass
+import hashlib
+import logging
+import os
+from pathlib import Path
+import stat
+
+from mir.dlsite import workinfo
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1 << 20
+
+
+def group_by_rjcode(paths: 'Iterable[Path]') -> 'Dict[str, List[Path]]':
+    """Group work directories by RJ code.
+
+    Symlinks are skipped, and a directory reached by more than one path
+    is only included once.  Only RJ codes with more than one directory
+    are returned.
+    """
+    groups = collections.defaultdict(dict)
+    for path in paths:
+        try:
+            st = os.lstat(path)
+        except OSError as e:
+            logger.warning('Skipping %s: %s', path, e)
+            continue
+        if not stat.S_ISDIR(st.st_mode):
+            continue
+        group = groups[workinfo.parse_rjcode(path.name)]
+        group.setdefault((st.st_dev, st.st_ino), path)
+    return {c: list(g.values()) for c, g in groups.items() if len(g) > 1}
+
+
+def find_duplicates(groups: 'Iterable[Iterable[Path]]',
+                    hashes: 'MutableMapping[str, Tuple[int, int, str]]',
+                    max_workers: int = 8) -> 'List[List[Path]]':
+    """Find directories with identical contents.
+
+    groups are sets of directories to compare with each other, such as
+    the copies of one work.  hashes maps absolute file paths to their
+    size, mtime in nanoseconds and SHA-256 hex digest; it is read and
+    updated only from the calling thread.  Files are hashed in a thread
+    pool.
+
+    Directories whose files are all hard links to the files of another
+    directory in the group take no extra space and are not reported.
+    Directories that cannot be read completely are skipped.
+
+    Returns lists of identical directories.
+    """
+    listings = {}
+    candidates = []
+    for group in groups:
+        by_sizes = collections.defaultdict(list)
+        for d in _distinct_dirs(group, listings):
+            sizes = tuple((f.name, f.size) for f in listings[d])
+            by_sizes[sizes].append(d)
+        candidates.extend(g for g in by_sizes.values() if len(g) > 1)
+    todo = {}
+    for d in (d for g in candidates for d in g):
+        for f in listings[d]:
+            key = os.fspath((d / f.name).absolute())
+            cached = hashes.get(key)
+            if cached is None or tuple(cached[:2]) != (f.size, f.mtime):
+                todo[key] = (f.size, f.mtime)
+    logger.info('Hashing %d files', len(todo))
+    failed = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = {executor.submit(_hash_file, key): key for key in todo}
+        for future in concurrent.futures.as_completed(futures):
+            key = futures[future]
+            try:
+                digest = future.result()
+            except OSError as e:
+                logger.warning('Cannot hash %s: %s', key, e)
+                failed.add(key)
+                continue
+            hashes[key] = todo[key] + (digest,)
+    duplicates = []
+    for group in candidates:
+        by_digests = collections.defaultdict(list)
+        for d in group:
+            keys = [os.fspath((d / f.name).absolute()) for f in listings[d]]
+            if failed.intersection(keys):
+                logger.warning('Skipping %s', d)
+                continue
+            digests = tuple((f.name, hashes[k][2])
+                            for f, k in zip(listings[d], keys))
+            by_digests[digests].append(d)
+        duplicates.extend(g for g in by_digests.values() if len(g) > 1)
+    return duplicates
+
+
+def _distinct_dirs(group: 'Iterable[Path]',
+                   listings: 'Dict[Path, List[_File]]') -> 'List[Path]':
+    """List directories in a group, storing their listings.
+
+    Of directories whose files are the same inodes, only the first is
+    returned.
+    """
+    dirs = {}
+    for d in group:
+        try:
+            listing = _list_files(d)
+        except OSError as e:
+            logger.warning('Skipping %s: %s', d, e)
+            continue
+        inodes = tuple((f.name, f.inode) for f in listing)
+        if inodes in dirs:
+            logger.debug('%s is hard linked to %s', d, dirs[inodes])
+            continue
+        dirs[inodes] = d
+        listings[d] = listing
+    return list(dirs.values())
+
+
+@dataclass(frozen=True, order=True)
+class _File:
+    """A regular file in a work directory."""
+    name: str
+    size: int
+    mtime: int
+    inode: 'Tuple[int, int]'
+
+
+def _list_files(top_dir: Path) -> 'List[_File]':
+    """List regular files in a directory tree.
+
+    Returns files sorted by path relative to top_dir.  Symlinks are not
+    followed.  Raises OSError if the tree cannot be read.
+    """
+    def onerror(e):
+        raise e
+
+    files = []
+    for dirpath, _dirnames, filenames in os.walk(top_dir, onerror=onerror):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            files.append(_File(os.path.relpath(path, top_dir), st.st_size,
+                               st.st_mtime_ns, (st.st_dev, st.st_ino)))
+    files.sort()
+    return files
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
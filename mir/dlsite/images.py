@@ -0,0 +1,181 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""DLsite work image downloading"""
+
+import concurrent.futures
+import hashlib
+import http.client
+import logging
+import os
+from pathlib import Path
+import posixpath
+import shelve
+import shutil
+import urllib.error
+import urllib.parse
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+
+class ImageStore:
+
+    """Content-addressed local store for work images.
+
+    Image contents are stored once under objects/, named by their
+    SHA-256 digest.  Each work gets a directory under works/ holding
+    hard links to its images, so images shared between works take up
+    space only once.  Unfinished downloads are kept under partial/ and
+    resumed on the next run.  An index of already downloaded URLs is
+    kept with shelve, so URLs are downloaded only once.
+    """
+
+    def __init__(self, path: 'PathLike'):
+        self.path = Path(path)
+        self._index = None
+
+    def __enter__(self):
+        for d in ('objects', 'partial', 'works'):
+            (self.path / d).mkdir(parents=True, exist_ok=True)
+        self._index = shelve.open(os.fspath(self.path / 'index'))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._index.close()
+
+    def work_dir(self, rjcode: str) -> Path:
+        """Return the directory holding a work's images."""
+        return self.path / 'works' / rjcode
+
+    def object_path(self, digest: str) -> Path:
+        """Return the path for image contents with the given digest."""
+        return self.path / 'objects' / digest[:2] / digest
+
+    def download(self, works: 'Iterable[workinfo.Work]',
+                 max_workers: int = 8) -> int:
+        """Download images for works concurrently.
+
+        Returns the number of images downloaded.
+        """
+        if self._index is None:
+            raise ValueError('used unopened ImageStore')
+        wanted = {}
+        for work in works:
+            for url in work.images:
+                target = self.work_dir(work.rjcode) / _url_filename(url)
+                if not target.exists():
+                    wanted.setdefault(url, []).append(target)
+        to_fetch = [url for url in wanted if not self._have(url)]
+        count = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = {executor.submit(self._fetch, url): url
+                       for url in to_fetch}
+            for future in concurrent.futures.as_completed(futures):
+                url = futures[future]
+                try:
+                    self._index[url] = future.result()
+                except (OSError, urllib.error.URLError,
+                        http.client.HTTPException) as e:
+                    logger.warning('Failed to download %s: %s', url, e)
+                    continue
+                count += 1
+        for url, targets in wanted.items():
+            try:
+                digest = self._index[url]
+            except KeyError:
+                continue
+            for target in targets:
+                self._link(digest, target)
+        return count
+
+    def _have(self, url: str) -> bool:
+        """Return whether a URL's contents are in the store.
+
+        Index entries whose object was deleted are dropped, so the URL
+        is downloaded again.
+        """
+        try:
+            digest = self._index[url]
+        except KeyError:
+            return False
+        if self.object_path(digest).exists():
+            return True
+        logger.debug('Object for %s is missing', url)
+        del self._index[url]
+        return False
+
+    def _fetch(self, url: str) -> str:
+        """Download a URL into the store, returning its digest."""
+        partial = self.path / 'partial' / hashlib.sha256(url.encode()).hexdigest()
+        _download(url, partial)
+        h = hashlib.sha256()
+        with partial.open('rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        obj = self.object_path(digest)
+        if obj.exists():
+            logger.debug('Already have %s as %s', url, digest)
+            partial.unlink()
+        else:
+            obj.parent.mkdir(exist_ok=True)
+            partial.replace(obj)
+        return digest
+
+    def _link(self, digest: str, target: Path):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(self.object_path(digest), target)
+        except FileExistsError:
+            pass
+
+
+def _download(url: str, path: Path):
+    """Download a URL to path, resuming if path already has data."""
+    try:
+        offset = path.stat().st_size
+    except FileNotFoundError:
+        offset = 0
+    request = urllib.request.Request(url)
+    if offset:
+        logger.debug('Resuming %s at %d', url, offset)
+        request.add_header('Range', f'bytes={offset}-')
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+        if e.code == 416 and offset:
+            # The partial download is already complete.
+            return
+        raise
+    with response:
+        mode = 'ab' if response.status == 206 else 'wb'
+        with path.open(mode) as f:
+            shutil.copyfileobj(response, f)
+
+
+def _url_filename(url: str) -> str:
+    """Return the filename to use for an image URL."""
+    return posixpath.basename(urllib.parse.urlsplit(url).path)
+
+
+_STORE = Path.home() / '.cache' / 'mir.dlsite.images'
+
+
+def get_store() -> ImageStore:
+    """Create a default ImageStore instance."""
+    return ImageStore(_STORE)
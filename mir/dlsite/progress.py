@@ -0,0 +1,174 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Progress reporting for batch runs
+
+Library functions that loop over works, such as
+CachedFetcher.fetch_many(), accept a Progress instance and update its
+counters.  Progress passes a Snapshot of the counters to its report
+callback at most once per interval, and once more on close().
+
+A run may have several phases, such as fetching and then renaming.
+Each phase counts processed items, rate and ETA afresh; cache counters
+carry over.
+"""
+
+from dataclasses import asdict, dataclass
+import json
+import sys
+import threading
+import time
+
+
+@dataclass
+class Snapshot:
+    """Progress counters at a point in time."""
+    processed: int
+    total: 'Optional[int]'
+    elapsed: float
+    rate: float
+    cache_hits: int
+    cache_misses: int
+    in_flight: int
+    eta: 'Optional[float]'
+    phase: 'Optional[str]' = None
+
+    @property
+    def hit_ratio(self) -> 'Optional[float]':
+        lookups = self.cache_hits + self.cache_misses
+        if not lookups:
+            return None
+        return self.cache_hits / lookups
+
+
+class Progress:
+
+    """Thread safe progress counters.
+
+    report is called with a Snapshot at most every interval seconds.
+    If report is None, progress is counted but not reported.
+    """
+
+    def __init__(self, report: 'Callable[[Snapshot], None]' = None,
+                 total: int = None, interval: float = 1,
+                 clock: 'Callable[[], float]' = time.monotonic,
+                 phase: str = None):
+        self.total = total
+        self.phase = phase
+        self._report = report
+        self._interval = interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._start = clock()
+        self._last_report = self._start
+        self._processed = 0
+        self._hits = 0
+        self._misses = 0
+        self._in_flight = 0
+
+    def start_phase(self, phase: str, total: int = None):
+        """Report the current phase as finished and start another."""
+        if self.phase is not None:
+            self.close()
+        with self._lock:
+            self.phase = phase
+            self.total = total
+            self._processed = 0
+            self._start = self._last_report = self._clock()
+
+    def processed(self, n: int = 1):
+        with self._lock:
+            self._processed += n
+        self._maybe_report()
+
+    def cache_hit(self, n: int = 1):
+        with self._lock:
+            self._hits += n
+
+    def cache_miss(self, n: int = 1):
+        with self._lock:
+            self._misses += n
+
+    def fetch_started(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def fetch_finished(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def snapshot(self) -> Snapshot:
+        with self._lock:
+            elapsed = self._clock() - self._start
+            rate = self._processed / elapsed if elapsed > 0 else 0.0
+            eta = None
+            if self.total is not None and rate > 0:
+                eta = max(self.total - self._processed, 0) / rate
+            return Snapshot(processed=self._processed, total=self.total,
+                            elapsed=elapsed, rate=rate,
+                            cache_hits=self._hits, cache_misses=self._misses,
+                            in_flight=self._in_flight, eta=eta,
+                            phase=self.phase)
+
+    def close(self):
+        """Report final progress."""
+        if self._report is not None:
+            self._report(self.snapshot())
+
+    def _maybe_report(self):
+        if self._report is None:
+            return
+        with self._lock:
+            now = self._clock()
+            if now - self._last_report < self._interval:
+                return
+            self._last_report = now
+        self._report(self.snapshot())
+
+
+def text_reporter(prefix: str, stream=None) -> 'Callable[[Snapshot], None]':
+    """Return a report callback writing human readable lines."""
+    def report(s: Snapshot):
+        out = sys.stderr if stream is None else stream
+        parts = [f'{s.processed}' if s.total is None
+                 else f'{s.processed}/{s.total}',
+                 f'{s.rate:.1f}/s']
+        if s.hit_ratio is not None:
+            parts.append(f'cache {s.hit_ratio:.0%} hits')
+        if s.in_flight:
+            parts.append(f'{s.in_flight} fetching')
+        if s.eta is not None:
+            parts.append(f'ETA {s.eta:.0f}s')
+        head = prefix if s.phase is None else f'{prefix}: {s.phase}'
+        print(f'{head}: ' + ', '.join(parts), file=out, flush=True)
+    return report
+
+
+def json_reporter(stream=None) -> 'Callable[[Snapshot], None]':
+    """Return a report callback writing JSON lines."""
+    def report(s: Snapshot):
+        out = sys.stderr if stream is None else stream
+        d = asdict(s)
+        d['hit_ratio'] = s.hit_ratio
+        print(json.dumps(d), file=out, flush=True)
+    return report
+
+
+def get_reporter(kind: str, prefix: str) -> 'Callable[[Snapshot], None]':
+    """Return a report callback by kind, text or json."""
+    if kind == 'text':
+        return text_reporter(prefix)
+    if kind == 'json':
+        return json_reporter()
+    raise ValueError(f'unknown progress format {kind!r}')
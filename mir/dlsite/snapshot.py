@@ -0,0 +1,220 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Read-only cache snapshots
+
+A snapshot freezes the works in a CachedFetcher cache into a single
+immutable file, which is memory mapped for lookups.  Processes opening
+the same snapshot share it through the page cache, and a lookup only
+unpickles the work asked for.
+
+The file format is a header (magic and work count), an index of
+fixed size entries sorted by RJ code, and the pickled works:
+
+    header: 8s magic, I count
+    entry:  16s rjcode (NUL padded), Q offset, I length
+"""
+
+import bisect
+import logging
+import mmap
+import os
+import pickle
+import struct
+
+from mir.dlsite import cache
+from mir.dlsite.progress import Progress
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b'MDLSNAP1'
+_HEADER = struct.Struct('>8sI')
+_ENTRY = struct.Struct('>16sQI')
+_CODE_SIZE = 16
+
+
+def write_snapshot(cache_path: 'PathLike', path: 'PathLike') -> int:
+    """Write a snapshot of the works in a cache file.
+
+    Cached works are copied without unpickling them.  The snapshot is
+    replaced atomically, so readers of an older snapshot at path are
+    not disturbed.  Returns the number of works written.
+    """
+    import dbm
+    with cache.lock(cache_path, shared=True):
+        with dbm.open(os.fspath(cache_path), 'r') as db:
+            codes = sorted(k for k in db.keys() if b':' not in k)
+            for code in codes:
+                if len(code) > _CODE_SIZE:
+                    raise ValueError(f'RJ code too long: {code!r}')
+            path = os.fspath(path)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            try:
+                with open(tmp, 'wb') as f:
+                    _write(f, db, codes)
+                os.replace(tmp, path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+                raise
+    logger.info('Wrote snapshot of %d works to %s', len(codes), path)
+    return len(codes)
+
+
+def _write(f, db, codes: 'List[bytes]'):
+    f.write(_HEADER.pack(_MAGIC, len(codes)))
+    offset = _HEADER.size + _ENTRY.size * len(codes)
+    for code in codes:
+        length = len(db[code])
+        f.write(_ENTRY.pack(code, offset, length))
+        offset += length
+    for code in codes:
+        f.write(db[code])
+
+
+class Snapshot:
+
+    """Read-only mapping of RJ codes to works in a snapshot file.
+
+    Snapshot is a context manager; the file is mapped while open.
+    """
+
+    def __init__(self, path: 'PathLike'):
+        self._path = path
+        self._mmap = None
+        self._count = 0
+
+    def __enter__(self):
+        with open(self._path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC:
+            self.close()
+            raise ValueError(f'{self._path} is not a snapshot file')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> 'Iterator[str]':
+        for i in range(self._count):
+            yield self._code(i).rstrip(b'\0').decode()
+
+    def __contains__(self, rjcode) -> bool:
+        return self._find(rjcode) is not None
+
+    def __getitem__(self, rjcode: str) -> 'workinfo.Work':
+        i = self._find(rjcode)
+        if i is None:
+            raise KeyError(rjcode)
+        _code, offset, length = _ENTRY.unpack_from(
+            self._mmap, _HEADER.size + _ENTRY.size * i)
+        return pickle.loads(self._mmap[offset:offset + length])
+
+    def get(self, rjcode: str, default=None):
+        try:
+            return self[rjcode]
+        except KeyError:
+            return default
+
+    def _code(self, i: int) -> bytes:
+        start = _HEADER.size + _ENTRY.size * i
+        return self._mmap[start:start + _CODE_SIZE]
+
+    def _find(self, rjcode: str) -> 'Optional[int]':
+        """Binary search the index for an RJ code."""
+        if self._mmap is None:
+            raise ValueError('used unopened Snapshot')
+        key = rjcode.encode().ljust(_CODE_SIZE, b'\0')
+        i = bisect.bisect_left(_Index(self), key)
+        if i < self._count and self._code(i) == key:
+            return i
+        return None
+
+
+class _Index:
+
+    """Sequence view of a snapshot's index keys, for bisect."""
+
+    def __init__(self, snapshot: Snapshot):
+        self._snapshot = snapshot
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __getitem__(self, i: int) -> bytes:
+        return self._snapshot._code(i)
+
+
+class SnapshotFetcher:
+
+    """DLSite work fetcher that reads a snapshot.
+
+    SnapshotFetcher can be used like CachedFetcher for reading.  Works
+    not in the snapshot are fetched with fetcher, if given, but are not
+    stored; otherwise KeyError is raised.
+    """
+
+    def __init__(self, path: 'PathLike', fetcher=None):
+        self._snapshot = Snapshot(path)
+        self._fetcher = fetcher
+
+    def __call__(self, rjcode: str) -> 'workinfo.Work':
+        try:
+            return self._snapshot[rjcode]
+        except KeyError:
+            if self._fetcher is None:
+                raise
+        return self._fetcher(rjcode)
+
+    def fetch_many(self, rjcodes: 'Iterable[str]', refresh: bool = False,
+                   max_workers: int = 8,
+                   progress: 'Optional[Progress]' = None,
+                   ) -> 'Dict[str, workinfo.Work]':
+        """Get many works.
+
+        refresh and max_workers are accepted for compatibility with
+        CachedFetcher and ignored; misses are fetched one at a time.
+        """
+        if progress is None:
+            progress = Progress()
+        works = {}
+        for rjcode in dict.fromkeys(rjcodes):
+            work = self._snapshot.get(rjcode)
+            if work is not None:
+                progress.cache_hit()
+            else:
+                progress.cache_miss()
+                work = self(rjcode)
+            works[rjcode] = work
+            progress.processed()
+        return works
+
+    def __enter__(self):
+        self._snapshot.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._snapshot.close()
@@ -0,0 +1,174 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Link views of organized works.
+
+A view is a directory tree of links pointing at work directories, so an
+organized layout can be built without moving any data.  Links are
+either symlinks to the work directories, or copies of the work
+directory trees with every file hard linked.
+
+The view directory holds a manifest of the links it contains, so
+updates only touch links whose target changed, and only ever remove
+what the view created.
+"""
+
+from dataclasses import dataclass
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+
+logger = logging.getLogger(__name__)
+
+_MANIFEST = '.dlsite-view.json'
+
+SYMLINK = 'symlink'
+HARDLINK = 'hardlink'
+
+
+@dataclass
+class Stats:
+    """Counts of view changes."""
+    created: int = 0
+    removed: int = 0
+    unchanged: int = 0
+
+
+def update_view(view_dir: 'PathLike', targets: 'Mapping[Path, Path]',
+                mode: str = SYMLINK, prune: bool = True,
+                dry_run: bool = False,
+                progress: 'Optional[Progress]' = None) -> Stats:
+    """Update a view.
+
+    targets maps paths in the view, relative to view_dir, to the work
+    directories they should link to.  If prune is true, links from
+    earlier updates that are not in targets are removed.  If progress
+    is given, it counts each target as processed.
+
+    The manifest is saved even if the update fails partway.  Links
+    already in place but missing from the manifest, as left by an
+    interrupted update, are adopted; other files in the way are left
+    alone with a warning.
+    """
+    if mode not in (SYMLINK, HARDLINK):
+        raise ValueError(f'unknown link mode {mode!r}')
+    view_dir = Path(view_dir)
+    manifest = _load_manifest(view_dir)
+    if manifest.get('mode', mode) != mode:
+        raise ValueError(f'view {view_dir} uses {manifest["mode"]} links')
+    old = manifest.get('links', {})
+    new = {os.fspath(p): os.path.abspath(t) for p, t in targets.items()}
+    stats = Stats()
+    links = dict(old)
+    try:
+        if prune:
+            for path in old.keys() - new.keys():
+                logger.info('Removing %s', path)
+                stats.removed += 1
+                if not dry_run:
+                    _remove_link(view_dir, Path(path))
+                del links[path]
+        for path, target in new.items():
+            if progress is not None:
+                progress.processed()
+            link = view_dir / path
+            if old.get(path) == target and os.path.lexists(link):
+                stats.unchanged += 1
+                continue
+            if path not in old and os.path.lexists(link):
+                if _is_link(link, Path(target), mode):
+                    logger.debug('Adopting %s', path)
+                    stats.unchanged += 1
+                    links[path] = target
+                else:
+                    logger.warning('Skipping %s: already exists', path)
+                continue
+            logger.info('Linking %s to %s', path, target)
+            stats.created += 1
+            if dry_run:
+                continue
+            if path in old:
+                _remove_link(view_dir, Path(path))
+                del links[path]
+            _make_link(link, Path(target), mode)
+            links[path] = target
+    finally:
+        if not dry_run:
+            _save_manifest(view_dir, {'mode': mode, 'links': links})
+    return stats
+
+
+def _make_link(link: Path, target: Path, mode: str):
+    link.parent.mkdir(parents=True, exist_ok=True)
+    if mode == SYMLINK:
+        link.symlink_to(target, target_is_directory=True)
+        return
+    try:
+        shutil.copytree(target, link, copy_function=os.link, symlinks=True)
+    except BaseException:
+        # Don't leave a partial copy behind, such as when the view is
+        # on another file system (EXDEV).
+        shutil.rmtree(link, ignore_errors=True)
+        raise
+
+
+def _is_link(link: Path, target: Path, mode: str) -> bool:
+    """Return whether a path already links to target."""
+    if mode == SYMLINK:
+        return link.is_symlink() and os.readlink(link) == os.fspath(target)
+    if link.is_symlink() or not link.is_dir():
+        return False
+    for dirpath, _dirnames, filenames in os.walk(target):
+        rel = os.path.relpath(dirpath, target)
+        for name in filenames:
+            try:
+                if not os.path.samefile(os.path.join(dirpath, name),
+                                        link / rel / name):
+                    return False
+            except FileNotFoundError:
+                return False
+    return True
+
+
+def _remove_link(view_dir: Path, path: Path):
+    link = view_dir / path
+    if link.is_symlink():
+        link.unlink()
+    elif link.is_dir():
+        shutil.rmtree(link)
+    for parent in path.parents:
+        if parent == Path():
+            break
+        try:
+            (view_dir / parent).rmdir()
+        except OSError:
+            break
+
+
+def _load_manifest(view_dir: Path) -> dict:
+    try:
+        with (view_dir / _MANIFEST).open() as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_manifest(view_dir: Path, manifest: dict):
+    view_dir.mkdir(parents=True, exist_ok=True)
+    tmp = view_dir / (_MANIFEST + '.tmp')
+    with tmp.open('w') as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(tmp, view_dir / _MANIFEST)
@@ -0,0 +1,292 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Watch directories for DLsite works.
+
+Watchers report work directories (directories whose name contains an RJ
+code) that appear or change under a top directory.  Work directories
+are reported relative to the top directory.  InotifyWatcher is used on
+Linux and PollingWatcher elsewhere.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+from pathlib import Path
+import select
+import struct
+import sys
+import time
+
+from mir.dlsite import workinfo
+
+logger = logging.getLogger(__name__)
+
+
+def get_watcher(top_dir: 'PathLike', recursive: bool = False,
+                poll_interval: float = 10):
+    """Create the best available watcher for top_dir."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(top_dir, recursive)
+        except OSError as e:
+            logger.warning('Cannot use inotify, polling instead: %s', e)
+    return PollingWatcher(top_dir, recursive, poll_interval)
+
+
+class Debouncer:
+
+    """Track work directories until they have been quiet for a while."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._pending = {}
+
+    def add(self, path: Path, now: float) -> bool:
+        """Record activity for a path, returning True if it is new."""
+        new = path not in self._pending
+        self._pending[path] = now
+        return new
+
+    def ready(self, now: float) -> 'List[Path]':
+        """Remove and return paths that have been quiet long enough."""
+        ready = [p for p, t in self._pending.items() if now - t >= self.delay]
+        for p in ready:
+            del self._pending[p]
+        return ready
+
+
+def recently_modified(path: 'PathLike', age: float) -> bool:
+    """Return True if anything in a tree changed in the last age seconds."""
+    cutoff = time.time() - age
+    for dirpath, _dirnames, filenames in os.walk(path):
+        for p in [dirpath] + [os.path.join(dirpath, n) for n in filenames]:
+            try:
+                if os.lstat(p).st_mtime >= cutoff:
+                    return True
+            except FileNotFoundError:
+                continue
+    return False
+
+
+class PollingWatcher:
+
+    """Watcher that rescans the top directory periodically.
+
+    A work directory is reported when it first appears and whenever its
+    modification time changes.  Only the work directory itself is
+    checked, so writes deeper in a work are not reported; see
+    recently_modified().
+    """
+
+    def __init__(self, top_dir: 'PathLike', recursive: bool = False,
+                 interval: float = 10):
+        self._top_dir = Path(top_dir)
+        self._recursive = recursive
+        self._interval = interval
+        self._known = self._scan()
+        self._last = time.monotonic()
+
+    def events(self, timeout: float) -> 'Set[Path]':
+        """Wait up to timeout seconds and return active work paths."""
+        wait = self._last + self._interval - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(wait, 0))
+        self._last = time.monotonic()
+        current = self._scan()
+        changed = {p for p, mtime in current.items()
+                   if self._known.get(p) != mtime}
+        self._known = current
+        return changed
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _scan(self) -> 'Dict[Path, int]':
+        found = {}
+        for dirpath, dirnames, _filenames in os.walk(self._top_dir):
+            for n in dirnames:
+                if workinfo.contains_rjcode(n):
+                    p = Path(dirpath, n)
+                    try:
+                        found[p.relative_to(self._top_dir)] = p.stat().st_mtime_ns
+                    except FileNotFoundError:
+                        continue
+            if self._recursive:
+                dirnames[:] = [n for n in dirnames
+                               if not workinfo.contains_rjcode(n)]
+            else:
+                dirnames.clear()
+        return found
+
+
+_IN_MODIFY = 0x2
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ISDIR = 0x40000000
+
+_CONTAINER_MASK = _IN_CREATE | _IN_MOVED_TO
+_WORK_MASK = _IN_CREATE | _IN_MOVED_TO | _IN_MODIFY | _IN_CLOSE_WRITE
+
+_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+
+    """Watcher using Linux inotify.
+
+    The top directory (and with recursive, its non-work subdirectories)
+    is watched for new directories.  Work directories and all their
+    subdirectories are also watched, so that files still being written
+    anywhere in a work are reported as activity.
+    """
+
+    def __init__(self, top_dir: 'PathLike', recursive: bool = False):
+        self._top_dir = Path(top_dir)
+        self._recursive = recursive
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            _raise_errno()
+        # watch descriptor -> (relative path, work path or None)
+        self._watches = {}
+        try:
+            self._add_tree(Path())
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def events(self, timeout: float) -> 'Set[Path]':
+        """Wait up to timeout seconds and return active work paths."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                break
+            changed.update(self._handle(data))
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _handle(self, data: bytes) -> 'Iterable[Path]':
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset+length].rstrip(b'\0'))
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                logger.warning('inotify queue overflowed, rescanning')
+                yield from self._add_tree(Path())
+                continue
+            if mask & _IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            try:
+                path, work = self._watches[wd]
+            except KeyError:
+                continue
+            if work is not None:
+                if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._add_work_tree(path / name, work)
+                yield work
+            elif mask & _IN_ISDIR:
+                yield from self._add_dir(path / name)
+
+    def _add_tree(self, path: Path) -> 'Iterable[Path]':
+        """Watch a container directory and its contents.
+
+        Returns the work directories found.
+        """
+        self._add_watch(path, _CONTAINER_MASK, None)
+        found = []
+        with os.scandir(self._top_dir / path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    found.extend(self._add_dir(path / entry.name))
+        return found
+
+    def _add_dir(self, path: Path) -> 'List[Path]':
+        if workinfo.contains_rjcode(path.name):
+            self._add_work_tree(path, path)
+            return [path]
+        if self._recursive:
+            return self._add_tree(path)
+        return []
+
+    def _add_work_tree(self, path: Path, work: Path):
+        """Watch a directory inside a work and its subdirectories."""
+        self._add_watch(path, _WORK_MASK, work)
+        try:
+            with os.scandir(self._top_dir / path) as it:
+                subdirs = [e.name for e in it
+                           if e.is_dir(follow_symlinks=False)]
+        except OSError:
+            return
+        for name in subdirs:
+            self._add_work_tree(path / name, work)
+
+    def _add_watch(self, path: Path, mask: int, work: 'Optional[Path]'):
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(self._top_dir / path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                logger.warning('Cannot watch %s: inotify watch limit'
+                               ' reached (see fs.inotify.max_user_watches);'
+                               ' changes in it will be missed', path)
+            else:
+                # The directory may have been moved away already.
+                logger.debug('Cannot watch %s: %s', path, os.strerror(err))
+            return
+        self._watches[wd] = (path, work)
+
+
+def _load_libc():
+    name = ctypes.util.find_library('c')
+    if name is None:
+        raise OSError('cannot find libc')
+    libc = ctypes.CDLL(name, use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError('libc has no inotify')
+    return libc
+
+
+def _raise_errno():
+    errno = ctypes.get_errno()
+    raise OSError(errno, os.strerror(errno))
@@ -16,11 +16,19 @@
 
 from dataclasses import dataclass, field
 from enum import Enum
+import functools
+import io
+import mmap
 from pathlib import Path
 import re
+import string
 
 
-_RJCODE_PATTERN = re.compile(r'RJ[0-9]+')
+# Product code prefixes of the DLsite stores in api._STORES.
+_PREFIXES = ('RJ', 'RE', 'VJ', 'BJ')
+# Codes must not follow a letter, so words like SCORE2019 don't match.
+_RJCODE_PATTERN = re.compile(r'(?<![A-Za-z])(?:%s)[0-9]+'
+                             % '|'.join(_PREFIXES))
 
 
 class AgeRating(Enum):
@@ -31,7 +39,11 @@ class AgeRating(Enum):
 
 
 def parse_rjcode(string) -> str:
-    """Parse RJ code from a string."""
+    """Parse RJ code from a string.
+
+    Product codes of the other DLsite stores, such as VJ codes, are
+    also accepted.
+    """
     match = _RJCODE_PATTERN.search(string)
     if match is None:
         raise ValueError('No rjcode found.')
@@ -43,6 +55,91 @@ def contains_rjcode(string) -> bool:
     return bool(_RJCODE_PATTERN.search(string))
 
 
+def find_rjcodes(buffer, prefixes: 'Iterable[str]' = _PREFIXES,
+                 ignore_case: bool = False,
+                 first_per_line: bool = False) -> 'Iterable[Tuple[int, str]]':
+    """Find RJ codes in a buffer in one pass.
+
+    buffer may be a str or a bytes-like object such as an mmap.  Yield
+    (offset, rjcode) pairs for every code found.
+
+    prefixes are the product code prefixes to look for, by default
+    those of all DLsite stores.  As for parse_rjcode(), a code must not
+    follow a letter.  If ignore_case
+    is true, codes are matched regardless of case and returned upper
+    case.  If first_per_line is true, only the first code on each line
+    is yielded, like parse_rjcode() called on each line.
+    """
+    is_bytes = not isinstance(buffer, str)
+    pattern = _bulk_pattern(tuple(prefixes), ignore_case, first_per_line,
+                            is_bytes)
+    for match in pattern.finditer(buffer):
+        code = match.group(1)
+        if is_bytes:
+            code = code.decode('ascii')
+        if ignore_case:
+            code = code.upper()
+        yield match.start(1), code
+
+
+def scan_rjcodes_file(file, chunk_size: int = 1 << 20,
+                      **kwargs) -> 'Iterable[Tuple[int, str]]':
+    """Find RJ codes in a binary file in one pass.
+
+    Regular files are memory mapped; other files such as pipes are read
+    in chunks split on line boundaries.  Offsets are relative to the
+    current file position for pipes and to the start of the file for
+    mapped files.  Keyword arguments are passed to find_rjcodes().
+    """
+    try:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        yield from _scan_chunks(file, chunk_size, **kwargs)
+        return
+    with buffer:
+        yield from find_rjcodes(buffer, **kwargs)
+
+
+def _scan_chunks(file, chunk_size: int, **kwargs) -> 'Iterable[Tuple[int, str]]':
+    # read1() returns what is available instead of waiting for a full
+    # chunk, so codes from a slow pipe are found as lines arrive.
+    read = getattr(file, 'read1', file.read)
+    base = 0
+    rest = b''
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+        data = rest + chunk
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            rest = data
+            continue
+        for offset, code in find_rjcodes(memoryview(data)[:end], **kwargs):
+            yield base + offset, code
+        base += end
+        rest = data[end:]
+    if rest:
+        for offset, code in find_rjcodes(rest, **kwargs):
+            yield base + offset, code
+
+
+@functools.lru_cache(maxsize=None)
+def _bulk_pattern(prefixes: 'Tuple[str, ...]', ignore_case: bool,
+                  first_per_line: bool, is_bytes: bool):
+    alternatives = '|'.join(re.escape(p) for p in prefixes)
+    pattern = f'(?<![A-Za-z])((?:{alternatives})[0-9]+)'
+    flags = 0
+    if first_per_line:
+        pattern = r'^[^\n]*?' + pattern
+        flags |= re.MULTILINE
+    if ignore_case:
+        flags |= re.IGNORECASE
+    if is_bytes:
+        pattern = pattern.encode('ascii')
+    return re.compile(pattern, flags)
+
+
 @dataclass
 class Work:
     """DLSite work info data class."""
@@ -71,6 +168,108 @@ def work_path(work) -> Path:
     return path
 
 
+def genre_path(work) -> Path:
+    """Return a path for a work organized by its first genre."""
+    genre = work.genres[0] if work.genres else 'no genre'
+    return Path(_escape_filename(genre)) / work_path(work)
+
+
+def age_path(work) -> Path:
+    """Return a path for a work organized by age rating."""
+    age = work.age.name if work.age is not None else 'unrated'
+    return Path(age) / work_path(work)
+
+
+def template_layout(template: str) -> 'Callable[[Work], Path]':
+    """Return a layout function that fills in a path template.
+
+    The template uses str.format() fields named after Work fields, as
+    well as genre for the first genre.  Path components that are empty
+    after formatting, such as {series} for a work without a series, are
+    dropped.  ValueError is raised for unknown fields and for . or ..
+    components.
+
+    >>> layout = template_layout('{maker}/{series}/{rjcode}')
+    >>> str(layout(Work('RJ123', 'foo', 'bar')))
+    'bar/RJ123'
+    """
+    parts = template.split('/')
+    known = _template_fields(Work('', '', ''))
+    for part in parts:
+        if part in ('.', '..'):
+            raise ValueError(f'invalid path component {part!r} in template')
+        for _text, name, _spec, _conv in string.Formatter().parse(part):
+            if name is not None and name not in known:
+                raise ValueError(f'unknown template field {name!r}')
+
+    def layout(work) -> Path:
+        fields = _template_fields(work)
+        path = Path()
+        for part in parts:
+            component = _escape_filename(part.format_map(fields))
+            if component:
+                path /= component
+        return path
+
+    return layout
+
+
+def _template_fields(work) -> 'Dict[str, str]':
+    return {
+        'rjcode': work.rjcode,
+        'name': work.name,
+        'maker': work.maker,
+        'series': work.series or '',
+        'age': work.age.name if work.age is not None else '',
+        'genre': work.genres[0] if work.genres else '',
+        'genres': ', '.join(work.genres),
+    }
+
+
+LAYOUTS = {
+    'maker': work_path,
+    'genre': genre_path,
+    'age': age_path,
+}
+
+
+def get_layout(spec: str) -> 'Callable[[Work], Path]':
+    """Return a layout function by name from LAYOUTS, or from a template.
+
+    A spec containing a { is treated as a template for
+    template_layout().
+    """
+    if '{' in spec:
+        return template_layout(spec)
+    try:
+        return LAYOUTS[spec]
+    except KeyError:
+        raise ValueError(f'unknown layout {spec!r}')
+
+
+def plan_layout(works: 'Mapping[Path, Work]',
+                layout: 'Callable[[Work], Path]' = work_path,
+                ) -> 'Tuple[Dict[Path, Path], Dict[Path, List[Path]]]':
+    """Plan a layout for many works at once.
+
+    works maps current paths to works.  Returns a dict mapping current
+    paths to new paths and a dict of collisions, mapping new paths to
+    the current paths that would share them.  Colliding paths after the
+    first are left out of the plan.
+    """
+    plan = {}
+    claimed = {}
+    collisions = {}
+    for path, work in works.items():
+        new = layout(work)
+        if new in claimed:
+            collisions.setdefault(new, [claimed[new]]).append(path)
+            continue
+        claimed[new] = path
+        plan[path] = new
+    return plan, collisions
+
+
 @dataclass
 class Track:
     """DLSite track info data class."""
@@ -79,4 +278,7 @@ class Track:
 
 
 def _escape_filename(filename: str) -> str:
-    return filename.replace('/', '_')
+    filename = filename.replace('/', '_')
+    if filename in ('.', '..'):
+        return filename.replace('.', '_')
+    return filename
@@ -18,11 +18,19 @@ import pytest
 
 from mir.dlsite import workinfo
 from mir.dlsite.workinfo import Track
+from tests.fakesite import FakeSite
 
 
 @pytest.fixture
-def patch_fetcher(stub_fetcher):
-    with mock.patch('mir.dlsite.api.get_fetcher') as get_fetcher:
+def fake_site():
+    with FakeSite() as site:
+        yield site
+
+
+@pytest.fixture
+def patch_fetcher(stub_fetcher, tmp_path):
+    with mock.patch('mir.dlsite.api.get_fetcher') as get_fetcher, \
+         mock.patch('mir.dlsite.daemon._SOCKET', tmp_path / 'no-daemon'):
         get_fetcher.return_value = stub_fetcher
         yield get_fetcher
 
@@ -58,6 +66,7 @@ class _Fetcher:
 
     def __init__(self, func):
         self._func = func
+        self._meta = {}
 
     def __enter__(self):
         return self
@@ -67,3 +76,16 @@ class _Fetcher:
 
     def __call__(self, rjcode):
         return self._func(rjcode)
+
+    def refresh(self, rjcode):
+        return self._func(rjcode)
+
+    def fetch_many(self, rjcodes, refresh=False, max_workers=8,
+                   progress=None):
+        works = {c: self._func(c) for c in rjcodes}
+        if progress is not None:
+            progress.processed(len(works))
+        return works
+
+    def meta(self, namespace):
+        return self._meta.setdefault(namespace, {})
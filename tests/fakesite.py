@@ -0,0 +1,282 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fake DLsite server serving recorded pages over local HTTP.
+
+Besides the recorded pages under pages/, the server can serve
+synthetic works, and can simulate latency and errors for load testing.
+All behavior is deterministic for a given seed.
+
+To run the server for benchmarks, run this module and point
+MIR_DLSITE_ROOT at the printed URL.
+"""
+
+import argparse
+import hashlib
+import html
+import http.server
+import json
+import logging
+import pathlib
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+_PAGES = pathlib.Path(__file__).parent / 'pages'
+_PAGE_PATTERN = re.compile(r'/([a-z-]+)/(work|announce)/=/product_id/([A-Z]{2}[0-9]+)\.html')
+_INFO_PATTERN = re.compile(r'/([a-z-]+)/product/info/ajax')
+_RANGE_PATTERN = re.compile(r'bytes=([0-9]+)-')
+
+# Synthetic works are numbered from here, clear of the recorded ones.
+SYNTHETIC_BASE = 90000000
+
+
+class FakeSite:
+
+    """Fake DLsite server.
+
+    Use as a context manager; root is the URL to pass to URLResolver.
+    Request paths are recorded in requests.  Extra files such as images
+    can be served by adding them to files, keyed by URL path; these
+    support Range requests.
+
+    synthetic is the number of generated works to serve, with RJ codes
+    starting at SYNTHETIC_BASE (see synthetic_rjcodes()).  A fraction
+    announce_rate of them only have an announce page.  Every response is
+    delayed by latency seconds, and a fraction error_rate of requests
+    fail with 503.
+    """
+
+    def __init__(self, pages: 'PathLike' = _PAGES,
+                 port: int = 0,
+                 synthetic: int = 0,
+                 announce_rate: float = 0,
+                 latency: float = 0,
+                 error_rate: float = 0,
+                 seed: int = 0):
+        self.pages = pathlib.Path(pages)
+        self.port = port
+        self.synthetic = synthetic
+        self.announce_rate = announce_rate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.requests = []
+        self.files = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def root(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def __enter__(self):
+        self._server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', self.port), _make_handler(self))
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05},
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def synthetic_rjcodes(self) -> 'List[str]':
+        """Return the RJ codes of the synthetic works."""
+        return [f'RJ{SYNTHETIC_BASE + i}' for i in range(self.synthetic)]
+
+    def page(self, section: str, rjcode: str) -> 'Optional[bytes]':
+        """Return page contents, or None if there is no such page."""
+        if self._is_synthetic(rjcode):
+            announce = self.is_announce(rjcode)
+            if (section == 'announce') != announce:
+                return None
+            return _synthetic_page(rjcode, announce).encode()
+        try:
+            return (self.pages / section / f'{rjcode}.html').read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def info(self, rjcodes: 'Iterable[str]') -> bytes:
+        """Return a JSON product info response."""
+        records = {}
+        for rjcode in rjcodes:
+            if self._is_synthetic(rjcode):
+                if not self.is_announce(rjcode):
+                    records[rjcode] = _synthetic_info(rjcode)
+                continue
+            path = self.pages / 'info' / f'{rjcode}.json'
+            try:
+                records[rjcode] = json.loads(path.read_text(encoding='utf-8'))
+            except FileNotFoundError:
+                continue
+        if not records:
+            return b'[]'
+        return json.dumps(records).encode()
+
+    def is_announce(self, rjcode: str) -> bool:
+        """Return True if a synthetic work only has an announce page."""
+        h = hashlib.sha256(f'{self.seed}:{rjcode}'.encode()).digest()
+        return int.from_bytes(h[:4], 'big') < self.announce_rate * 2**32
+
+    def should_fail(self) -> bool:
+        """Decide whether to fail the current request."""
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _is_synthetic(self, rjcode: str) -> bool:
+        n = int(rjcode[2:])
+        return SYNTHETIC_BASE <= n < SYNTHETIC_BASE + self.synthetic
+
+
+def _make_handler(site: FakeSite):
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            with site._lock:
+                site.requests.append(self.path)
+            if site.latency:
+                time.sleep(site.latency)
+            if site.should_fail():
+                self.send_error(503)
+                return
+            url = urllib.parse.urlsplit(self.path)
+            if url.path in site.files:
+                self._send_file(site.files[url.path])
+                return
+            match = _PAGE_PATTERN.fullmatch(url.path)
+            if match is not None:
+                body = site.page(match.group(2), match.group(3))
+                if body is None:
+                    self.send_error(404)
+                    return
+                self._send(body, 'text/html; charset=utf-8')
+                return
+            if _INFO_PATTERN.fullmatch(url.path):
+                query = urllib.parse.parse_qs(url.query)
+                rjcodes = ','.join(query.get('product_id', [])).split(',')
+                self._send(site.info(rjcodes), 'application/json')
+                return
+            self.send_error(404)
+
+        def _send_file(self, body: bytes):
+            match = _RANGE_PATTERN.fullmatch(self.headers.get('Range', ''))
+            if match is None:
+                self._send(body, 'application/octet-stream')
+                return
+            start = int(match.group(1))
+            if start >= len(body):
+                self.send_error(416)
+                return
+            self._send(body[start:], 'application/octet-stream', status=206)
+
+        def _send(self, body: bytes, content_type: str, status: int = 200):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    return Handler
+
+
+def synthetic_work(rjcode: str) -> dict:
+    """Return the fields of a synthetic work."""
+    n = int(rjcode[2:])
+    return {
+        'name': f'Synthetic work {n}',
+        'maker': f'Maker {n % 97}',
+        'series': f'Series {n % 13}' if n % 3 == 0 else None,
+        'age_category': n % 3 + 1,
+        'image': f'//img.example.com/{rjcode}_img_main.jpg',
+    }
+
+
+_AGE_ICONS = {1: 'icon_GEN', 2: 'icon_R15', 3: 'icon_ADL'}
+
+
+def _synthetic_page(rjcode: str, announce: bool) -> str:
+    w = synthetic_work(rjcode)
+    series = ''
+    if w['series'] is not None:
+        series = (f'<tr><th>シリーズ名</th>'
+                  f'<td><a href="#">{html.escape(w["series"])}</a></td></tr>')
+    note = 'Coming soon.' if announce else ''
+    return f'''\
+<html><body>
+<h1 id="work_name"><a href="#">{html.escape(w["name"])}</a></h1>
+<table id="work_maker"><tr><td><span class="maker_name"><a href="#">{html.escape(w["maker"])}</a></span></td></tr></table>
+<table id="work_outline">{series}
+<tr><th>年齢指定</th><td><span class="{_AGE_ICONS[w["age_category"]]}">age</span></td></tr>
+</table>
+<div class="product-slider-data"><div data-src="{w["image"]}"></div></div>
+<div id="main_inner"><div itemprop="description">Description of {rjcode}.<br/>{note}</div></div>
+</body></html>
+'''
+
+
+def _synthetic_info(rjcode: str) -> dict:
+    w = synthetic_work(rjcode)
+    return {
+        'site_id': 'maniax',
+        'age_category': w['age_category'],
+        'work_name': w['name'],
+        'maker_name': w['maker'],
+        'work_image': w['image'],
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0],
+                                     description=__doc__)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--synthetic', type=int, default=10000)
+    parser.add_argument('--announce-rate', type=float, default=0.1)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv[1:])
+    logging.basicConfig(level='INFO')
+    site = FakeSite(port=args.port, synthetic=args.synthetic,
+                    announce_rate=args.announce_rate, latency=args.latency,
+                    error_rate=args.error_rate, seed=args.seed)
+    with site:
+        print(f'MIR_DLSITE_ROOT={site.root}', flush=True)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
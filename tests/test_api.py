@@ -23,6 +23,7 @@ import pathlib
 import pytest
 
 from mir.dlsite import api
+from mir.dlsite import progress
 from mir.dlsite.workinfo import AgeRating
 from mir.dlsite.workinfo import Track
 
@@ -39,6 +40,51 @@ def test_get_announce_url():
     assert got == 'https://www.dlsite.com/maniax/announce/=/product_id/RJ123.html'
 
 
+def test_get_work_url_other_store():
+    got = api._get_work_url('VJ123')
+    assert got == 'https://www.dlsite.com/pro/work/=/product_id/VJ123.html'
+
+
+def test_get_work_url_unknown_prefix():
+    with pytest.raises(ValueError):
+        api._get_work_url('XX123')
+
+
+def test_url_resolver_uses_hint():
+    resolver = api.URLResolver({'RJ123': 'announce'})
+    got = [variant for variant, url in resolver.urls('RJ123')]
+    assert got == ['announce', 'work']
+
+
+def test_fetch_work_records_announce_hint(fake_urlopen):
+    hints = {}
+    api.fetch_work('RJ275695', api.URLResolver(hints))
+    assert hints == {'RJ275695': 'announce'}
+    fake_urlopen.reset_mock()
+    api.fetch_work('RJ275695', api.URLResolver(hints))
+    assert fake_urlopen.call_count == 1
+
+
+def test_fetch_work_memo(fake_urlopen):
+    memo = {}
+    work1 = api.fetch_work('RJ189758', memo=memo)
+    assert len(memo) == 1
+    with mock.patch.object(api, '_parse_work') as parse:
+        work2 = api.fetch_work('RJ189758', memo=memo)
+    parse.assert_not_called()
+    assert work1 == work2
+
+
+def test_fetch_work_memo_parser_version(fake_urlopen, monkeypatch):
+    memo = {}
+    api.fetch_work('RJ189758', memo=memo)
+    monkeypatch.setattr(api, '_PARSER_VERSION', api._PARSER_VERSION + 1)
+    with mock.patch.object(api, '_parse_work') as parse:
+        api.fetch_work('RJ189758', memo=memo)
+    parse.assert_called_once()
+    assert len(memo) == 1
+
+
 def test_fetch_work_with_series(fake_urlopen):
     work = api.fetch_work('RJ189758')
     assert work.rjcode == 'RJ189758'
@@ -111,6 +157,49 @@ def test_fetch_work_from_announce(fake_urlopen):
     assert work.series == 'キョウカ様による調教♪'
 
 
+def test_fetch_works_json(fake_site):
+    resolver = api.URLResolver(root=fake_site.root)
+    got = api.fetch_works(['RJ126928', 'RJ304732'], resolver)
+    assert got['RJ126928'].maker == 'クッキーボイス'
+    assert got['RJ126928'].age == AgeRating.R18
+    assert got['RJ126928'].images == ['https://img.dlsite.jp/modpub/images2/work/doujin/RJ127000/RJ126928_img_main.jpg']
+    assert got['RJ304732'].name == '東方錫の風～とうほうすずのかぜ～'
+    assert got['RJ304732'].age == AgeRating.AllAges
+    assert len(fake_site.requests) == 1
+
+
+def test_fetch_works_falls_back_to_scraping(fake_site):
+    resolver = api.URLResolver(root=fake_site.root)
+    got = api.fetch_works(['RJ173248', 'RJ275695'], resolver)
+    assert got['RJ173248'].maker == 'B-bishop'
+    assert got['RJ275695'].series == 'キョウカ様による調教♪'
+    assert len(fake_site.requests) == 4
+
+
+def test_fetch_works_scrapes_fields_missing_from_json(fake_site):
+    resolver = api.URLResolver(root=fake_site.root)
+    got = api.fetch_works(['RJ189758'], resolver, fields=['series'])
+    assert got['RJ189758'].series == '地獄級オナニーサポート'
+    assert not any('ajax' in r for r in fake_site.requests)
+
+
+def test_fetch_works_info_error_falls_back_to_scraping(fake_site):
+    resolver = api.URLResolver(root=fake_site.root)
+    with mock.patch.object(api, '_get_info',
+                           side_effect=urllib.error.URLError('down')):
+        got = api.fetch_works(['RJ126928'], resolver)
+    assert got['RJ126928'].maker == 'クッキーボイス'
+    assert len(fake_site.requests) == 1
+
+
+def test_fetch_works_batches(fake_site, monkeypatch):
+    monkeypatch.setattr(api, '_INFO_BATCH_SIZE', 2)
+    resolver = api.URLResolver(root=fake_site.root)
+    got = api.fetch_works(['RJ126928', 'RJ189758', 'RJ304732'], resolver)
+    assert len(got) == 3
+    assert len(fake_site.requests) == 2
+
+
 def test_cached_fetcher_used_without_context(tmpdir, fake_urlopen):
     fetcher = api.CachedFetcher(str(tmpdir.join('cache')), api.fetch_work)
     with pytest.raises(ValueError):
@@ -126,6 +215,63 @@ def test_cached_fetcher(tmpdir, fake_urlopen):
     assert work1.rjcode == work2.rjcode
 
 
+def test_cached_fetcher_remembers_url_variant(tmpdir, fake_urlopen):
+    fetcher = api.CachedFetcher(str(tmpdir.join('cache')), api.fetch_work)
+    with fetcher:
+        fetcher('RJ275695')
+    fake_urlopen.reset_mock()
+    with fetcher:
+        fetcher.refresh('RJ275695')
+        assert dict(fetcher.meta('url')) == {'RJ275695': 'announce'}
+    assert fake_urlopen.call_count == 1
+
+
+def test_cached_fetcher_fetch_many(tmpdir, fake_urlopen):
+    fetcher = api.CachedFetcher(str(tmpdir.join('cache')), api.fetch_work)
+    with fetcher:
+        fetcher('RJ189758')
+        fake_urlopen.reset_mock()
+        got = fetcher.fetch_many(['RJ189758', 'RJ173248', 'RJ275695'])
+        assert sorted(got) == ['RJ173248', 'RJ189758', 'RJ275695']
+        assert fake_urlopen.call_count == 3
+        assert dict(fetcher.meta('url'))['RJ275695'] == 'announce'
+        fake_urlopen.side_effect = _FakeError
+        assert fetcher('RJ275695').rjcode == 'RJ275695'
+
+
+def test_cached_fetcher_fetch_many_progress(tmpdir, fake_urlopen):
+    fetcher = api.CachedFetcher(str(tmpdir.join('cache')), api.fetch_work)
+    p = progress.Progress()
+    with fetcher:
+        fetcher('RJ189758')
+        fetcher.fetch_many(['RJ189758', 'RJ173248'], progress=p)
+    got = p.snapshot()
+    assert (got.processed, got.cache_hits, got.cache_misses) == (2, 1, 1)
+    assert got.in_flight == 0
+
+
+def test_cached_fetcher_fetch_many_error(tmpdir, fake_urlopen):
+    fetcher = api.CachedFetcher(str(tmpdir.join('cache')), api.fetch_work)
+    with fetcher:
+        with pytest.raises(urllib.error.HTTPError):
+            fetcher.fetch_many(['RJ189758', 'RJ1'])
+        fake_urlopen.side_effect = _FakeError
+        assert fetcher('RJ189758').rjcode == 'RJ189758'
+
+
+def test_cached_fetcher_refresh_reuses_parse(tmpdir, fake_urlopen):
+    fetcher = api.CachedFetcher(str(tmpdir.join('cache')), api.fetch_work)
+    with fetcher:
+        work1 = fetcher('RJ189758')
+        with mock.patch.object(api, '_parse_work') as parse:
+            work2 = fetcher.refresh('RJ189758')
+            fetcher.fetch_many(['RJ189758'], refresh=True)
+        parse.assert_not_called()
+        assert list(fetcher.meta('pagehash')) == ['RJ189758']
+        assert not any(k.startswith('parse:') for k in fetcher._shelf)
+    assert work1 == work2
+
+
 def test_get_fetcher():
     f = api.get_fetcher()
     assert isinstance(f, api.CachedFetcher)
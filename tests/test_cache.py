@@ -0,0 +1,104 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+
+import pytest
+
+from mir.dlsite import api
+from mir.dlsite import cache
+from mir.dlsite import workinfo
+from mir.dlsite.cmd import dlcache
+
+
+_counter = itertools.count()
+
+
+def _fetch(rjcode, resolver=None, memo=None):
+    # Growing entries leave dead space behind when overwritten.
+    work = workinfo.Work(rjcode, 'x' * 600 * next(_counter), 'maker')
+    if memo is not None:
+        memo[rjcode] = 'hash', work
+    return work
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    path = tmp_path / 'cache'
+    with api.CachedFetcher(path, _fetch) as fetcher:
+        for i in range(10):
+            fetcher(f'RJ{i}')
+        for _ in range(5):
+            for i in range(10):
+                fetcher.refresh(f'RJ{i}')
+    with api.CachedFetcher(path, _fetch) as fetcher:
+        fetcher('RJ7')
+        fetcher('RJ8')
+    return path
+
+
+def _keys(path):
+    import dbm
+    with dbm.open(str(path), 'r') as db:
+        return sorted(k.decode() for k in db.keys())
+
+
+def test_compact_keeps_live_entries(cache_path):
+    before = _keys(cache_path)
+    stats = cache.compact(cache_path)
+    assert stats.reclaimed > 0
+    assert stats.works_after == 10
+    assert _keys(cache_path) == before
+    with api.CachedFetcher(cache_path, None) as fetcher:
+        assert fetcher('RJ3').rjcode == 'RJ3'
+
+
+def test_compact_max_works_evicts_lru(cache_path):
+    stats = cache.compact(cache_path, cache.Policy(max_works=2))
+    assert stats.works_after == 2
+    assert _keys(cache_path) == [
+        'RJ7', 'RJ8', 'atime:RJ7', 'atime:RJ8',
+        'pagehash:RJ7', 'pagehash:RJ8']
+
+
+def test_compact_present(cache_path):
+    cache.compact(cache_path, cache.Policy(present={'RJ1'}))
+    assert [k for k in _keys(cache_path) if ':' not in k] == ['RJ1']
+
+
+def test_compact_locked(cache_path):
+    with api.CachedFetcher(cache_path, _fetch):
+        with pytest.raises(BlockingIOError):
+            cache.compact(cache_path, blocking=False)
+
+
+def test_dlcache_compact_prune_missing(cache_path, tmp_path, capsys):
+    (tmp_path / 'works' / 'foo' / 'RJ3 bar').mkdir(parents=True)
+    assert dlcache.main(['dlcache', '--cache', str(cache_path), 'compact',
+                         '--prune-missing', str(tmp_path / 'works')]) == 0
+    assert [k for k in _keys(cache_path) if ':' not in k] == ['RJ3']
+    out, err = capsys.readouterr()
+    assert 'removed 9 works' in out
+
+
+def test_compact_drops_missing_file_hashes(tmp_path):
+    path = tmp_path / 'cache'
+    present = tmp_path / 'present'
+    present.write_text('spam')
+    with api.CachedFetcher(path, _fetch) as fetcher:
+        hashes = fetcher.meta('datahash')
+        hashes[str(present)] = (4, 0, 'digest')
+        hashes[str(tmp_path / 'missing')] = (4, 0, 'digest')
+    cache.compact(path)
+    assert _keys(path) == [f'datahash:{present}']
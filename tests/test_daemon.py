@@ -0,0 +1,69 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from unittest import mock
+
+import pytest
+
+from mir.dlsite import daemon
+from mir.dlsite import workinfo
+
+
+@pytest.fixture
+def server(tmp_path, fat_stub_fetcher):
+    path = tmp_path / 'sock'
+    with daemon.Server(path, lambda: fat_stub_fetcher) as server:
+        thread = threading.Thread(target=server.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.start()
+        with mock.patch('mir.dlsite.daemon._SOCKET', path):
+            yield server
+        server.shutdown()
+        thread.join()
+
+
+def test_remote_fetcher(server, fat_stub_fetcher):
+    with daemon.get_fetcher() as fetcher:
+        assert isinstance(fetcher, daemon.RemoteFetcher)
+        work = fetcher('RJ123')
+        assert fetcher('RJ456').rjcode == 'RJ456'
+    assert work == fat_stub_fetcher('RJ123')
+
+
+def test_remote_fetcher_fetch_many(server):
+    with daemon.get_fetcher() as fetcher:
+        got = fetcher.fetch_many(['RJ1', 'RJ2'])
+    assert sorted(got) == ['RJ1', 'RJ2']
+    assert got['RJ2'].rjcode == 'RJ2'
+
+
+def test_remote_fetcher_error(server):
+    failing = mock.MagicMock(side_effect=ValueError('no such work'))
+    failing.__enter__.return_value = failing
+    failing.__exit__.return_value = False
+    server.get_fetcher = lambda: failing
+    with daemon.get_fetcher() as fetcher:
+        with pytest.raises(daemon.RemoteError):
+            fetcher('RJ123')
+
+
+def test_get_fetcher_falls_back(patch_fetcher, stub_fetcher):
+    assert daemon.get_fetcher() is stub_fetcher
+
+
+def test_work_dict_round_trip(fat_stub_fetcher):
+    work = fat_stub_fetcher('RJ123')
+    work.age = workinfo.AgeRating.R15
+    assert daemon._work_from_dict(daemon._work_to_dict(work)) == work
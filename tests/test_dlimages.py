@@ -0,0 +1,58 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+from unittest import mock
+
+import pytest
+
+from mir.dlsite.cmd import dlimages
+from mir.dlsite import workinfo
+
+
+@pytest.fixture
+def stub_fetcher(fake_site):
+    fake_site.files['/img/RJ1.jpg'] = b'one'
+    fake_site.files['/img/RJ2.jpg'] = b'two'
+    return _ImageFetcher(fake_site.root)
+
+
+class _ImageFetcher:
+
+    def __init__(self, root):
+        self._root = root
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def __call__(self, rjcode):
+        work = workinfo.Work(rjcode, 'name', 'group')
+        work.images = [f'{self._root}img/{rjcode}.jpg']
+        return work
+
+
+def test_dlimages(tmp_path, patch_fetcher):
+    dlimages.main(['dlimages', '-s', str(tmp_path), 'RJ1', 'RJ2'])
+    assert (tmp_path / 'works' / 'RJ1' / 'RJ1.jpg').read_bytes() == b'one'
+    assert (tmp_path / 'works' / 'RJ2' / 'RJ2.jpg').read_bytes() == b'two'
+
+
+def test_dlimages_stdin(tmp_path, patch_fetcher):
+    with mock.patch('sys.stdin', io.StringIO('foo RJ2 bar\n')):
+        dlimages.main(['dlimages', '-s', str(tmp_path)])
+    assert (tmp_path / 'works' / 'RJ2' / 'RJ2.jpg').read_bytes() == b'two'
+    assert not (tmp_path / 'works' / 'RJ1').exists()
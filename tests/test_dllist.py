@@ -13,8 +13,11 @@
 # limitations under the License.
 
 import io
+import json
 from unittest import mock
 
+import pytest
+
 from mir.dlsite.cmd import dllist
 
 
@@ -32,3 +35,37 @@ def test_dllist(capsys, patch_fetcher):
         dllist.main()
     out, err = capsys.readouterr()
     assert out == 'RJ12345 [group] name\n'
+
+
+def test_dllist_first_code_per_line(capsys):
+    with mock.patch('sys.argv', ['dllist', '--no-info', '-i', '--prefix', 'RJ', '--prefix', 'VJ']), \
+         mock.patch('sys.stdin', io.StringIO('rj1 RJ2\nfoo VJ3\n')):
+        dllist.main()
+    out, err = capsys.readouterr()
+    assert out == 'RJ1\nVJ3\n'
+
+
+def test_dllist_unknown_prefix(capsys):
+    with mock.patch('sys.argv', ['dllist', '--prefix', 'XX']), \
+         mock.patch('sys.stdin', io.StringIO('XX1\n')), \
+         pytest.raises(SystemExit):
+        dllist.main()
+    out, err = capsys.readouterr()
+    assert 'XX' in err
+
+
+def test_dllist_unknown_prefix_no_info(capsys):
+    with mock.patch('sys.argv', ['dllist', '--no-info', '--prefix', 'XX']), \
+         mock.patch('sys.stdin', io.StringIO('XX1\n')):
+        dllist.main()
+    out, err = capsys.readouterr()
+    assert out == 'XX1\n'
+
+
+def test_dllist_progress(capsys, patch_fetcher):
+    with mock.patch('sys.argv', ['dllist', '--progress', 'json']), \
+         mock.patch('sys.stdin', io.StringIO('RJ1\nRJ2\n')):
+        dllist.main()
+    out, err = capsys.readouterr()
+    assert out == 'RJ1 [group] name\nRJ2 [group] name\n'
+    assert json.loads(err.splitlines()[-1])['processed'] == 2
@@ -0,0 +1,70 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+from unittest import mock
+
+from mir.dlsite.cmd import dlmv
+from mir.dlsite.daemon import RemoteError
+
+
+def test_dlmv(tmp_path, monkeypatch, patch_fetcher):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'foo RJ123').touch()
+    with mock.patch('sys.argv', ['dlmv', 'foo RJ123']):
+        dlmv.main()
+    assert os.listdir(tmp_path) == ['RJ123 [group] name']
+
+
+def test_dlmv_batch(tmp_path, patch_fetcher):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'RJ1 foo').touch()
+    (tmp_path / 'RJ2 bar').touch()
+    files = [str(tmp_path / 'a' / 'RJ1 foo'), str(tmp_path / 'RJ2 bar')]
+    with mock.patch('sys.argv', ['dlmv', '-0']), \
+         mock.patch('sys.stdin', io.StringIO('\0'.join(files) + '\0')):
+        assert dlmv.main() == 0
+    assert os.listdir(tmp_path / 'a') == ['RJ1 [group] name']
+    assert (tmp_path / 'RJ2 [group] name').exists()
+
+
+def test_dlmv_batch_collision(tmp_path, patch_fetcher):
+    (tmp_path / 'RJ1 foo').touch()
+    (tmp_path / 'RJ1 bar').touch()
+    (tmp_path / 'RJ2 foo').touch()
+    (tmp_path / 'RJ2 [group] name').touch()
+    files = [str(tmp_path / n) for n in ('RJ1 foo', 'RJ1 bar', 'RJ2 foo')]
+    with mock.patch('sys.argv', ['dlmv', '-b'] + files):
+        assert dlmv.main() == 1
+    assert sorted(os.listdir(tmp_path)) == [
+        'RJ1 bar', 'RJ1 foo', 'RJ2 [group] name', 'RJ2 foo']
+
+
+def test_dlmv_batch_lookup_error(tmp_path, stub_fetcher):
+    def fetch(rjcode):
+        if rjcode == 'RJ2':
+            raise RemoteError('not found')
+        return stub(rjcode)
+
+    stub = stub_fetcher._func
+    stub_fetcher._func = fetch
+    (tmp_path / 'RJ1 foo').touch()
+    (tmp_path / 'RJ2 bar').touch()
+    files = [str(tmp_path / n) for n in ('RJ1 foo', 'RJ2 bar')]
+    with mock.patch('mir.dlsite.daemon.get_fetcher') as get_fetcher, \
+         mock.patch('sys.argv', ['dlmv', '-b'] + files):
+        get_fetcher.return_value = stub_fetcher
+        assert dlmv.main() == 1
+    assert sorted(os.listdir(tmp_path)) == ['RJ1 [group] name', 'RJ2 bar']
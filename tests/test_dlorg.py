@@ -14,7 +14,11 @@
 
 import os
 from pathlib import Path
+from unittest import mock
 
+import pytest
+
+from mir.dlsite import workinfo
 from mir.dlsite.cmd import dlorg
 
 
@@ -26,10 +30,11 @@ def test__find_works(tmpdir):
     ]
 
 
-def test__calculate_new_path(stub_fetcher):
-    work = Path('foo/RJ123')
-    got = dlorg._calculate_new_path(stub_fetcher, work)
-    assert got == Path('group/series/RJ123 name')
+def test_plan_layout_stub_work(stub_fetcher):
+    path = Path('foo/RJ123')
+    plan, collisions = workinfo.plan_layout({path: stub_fetcher('RJ123')})
+    assert plan == {path: Path('group/series/RJ123 name')}
+    assert collisions == {}
 
 
 def test_do__rename(tmpdir):
@@ -48,10 +53,15 @@ def test__remove_empty_dirs(tmpdir):
     assert os.listdir(str(tmpdir.join('foo'))) == ['spam']
 
 
-def test__add_dlsite_files(tmpdir, fat_stub_fetcher):
+def test__remove_empty_dirs_keeps_top_dir(tmpdir):
+    dlorg._remove_empty_dirs(str(tmpdir))
+    assert tmpdir.exists()
+
+
+def test__write_dlsite_files(tmpdir, fat_stub_fetcher):
     tmpdir.ensure('RJ123', dir=True)
     p = Path(str(tmpdir), 'RJ123')
-    dlorg._add_dlsite_files(fat_stub_fetcher, p)
+    dlorg._write_dlsite_files([(fat_stub_fetcher('RJ123'), p)], {})
     assert (p / 'dlsite-description.txt').exists()
     assert (p / 'dlsite-description.txt').read_text() == '''\
 Some text
@@ -65,16 +75,176 @@ Other text
 '''
 
 
-def test__add_dlsite_files_does_not_overwrite(tmpdir, fat_stub_fetcher):
+def test__write_dlsite_files_does_not_overwrite(tmpdir, fat_stub_fetcher):
     tmpdir.ensure('RJ123/dlsite-description.txt').write('asdf')
     p = Path(str(tmpdir), 'RJ123')
-    dlorg._add_dlsite_files(fat_stub_fetcher, p)
+    dlorg._write_dlsite_files([(fat_stub_fetcher('RJ123'), p)], {})
     assert (p / 'dlsite-description.txt').read_text() == 'asdf'
 
 
-def test__add_dlsite_files_missing_workinfo(tmpdir, stub_fetcher):
+def test__write_dlsite_files_missing_workinfo(tmpdir, stub_fetcher):
     tmpdir.ensure('RJ123', dir=True)
     p = Path(str(tmpdir), 'RJ123')
-    dlorg._add_dlsite_files(stub_fetcher, p)
+    dlorg._write_dlsite_files([(stub_fetcher('RJ123'), p)], {})
     assert not (p / 'dlsite-description.txt').exists()
     assert not (p / 'dlsite-tracklist.txt').exists()
+
+
+def test__write_dlsite_files_refresh(tmpdir, fat_stub_fetcher):
+    tmpdir.ensure('RJ123/dlsite-description.txt').write('old')
+    p = Path(str(tmpdir), 'RJ123')
+    work = fat_stub_fetcher('RJ123')
+    hashes = {}
+    got = dlorg._write_dlsite_files([(work, p)], hashes, refresh=True)
+    assert got == 2
+    assert (p / 'dlsite-description.txt').read_text() == work.description
+    assert len(hashes) == 2
+    got = dlorg._write_dlsite_files([(work, p)], hashes, refresh=True)
+    assert got == 0
+
+
+def test_main_add_descriptions(tmpdir, fat_stub_fetcher):
+    tmpdir.ensure('RJ123', dir=True)
+    with mock.patch('mir.dlsite.api.get_fetcher') as get_fetcher:
+        get_fetcher.return_value = fat_stub_fetcher
+        dlorg.main(['dlorg', '-d', str(tmpdir)])
+    p = Path(str(tmpdir), 'group', 'series', 'RJ123 name')
+    assert (p / 'dlsite-tracklist.txt').read_text() == '''\
+1. foo bar
+2. spam eggs
+'''
+    assert sorted(fat_stub_fetcher.meta('filehash')) == [
+        os.fspath(p / 'dlsite-description.txt'),
+        os.fspath(p / 'dlsite-tracklist.txt'),
+    ]
+
+
+def test__watch(tmpdir, stub_fetcher):
+    tmpdir.ensure('RJ123', dir=True)
+    top_dir = Path(str(tmpdir))
+    args = dlorg._parse_args(['dlorg', '--watch', '--debounce', '0',
+                              str(top_dir)])
+    watcher = mock.Mock()
+    watcher.events.side_effect = [{Path('RJ123')}, KeyboardInterrupt]
+    dlorg._watch(args, lambda: stub_fetcher, watcher)
+    assert os.listdir(str(tmpdir.join('group', 'series'))) == ['RJ123 name']
+    assert not (top_dir / 'RJ123').exists()
+
+
+def test__watch_waits_for_writes_in_subdirs(tmpdir, stub_fetcher):
+    tmpdir.ensure('RJ123/sub/file')
+    top_dir = Path(str(tmpdir))
+    args = dlorg._parse_args(['dlorg', '--watch', '--debounce', '60',
+                              str(top_dir)])
+    watcher = mock.Mock()
+    watcher.events.side_effect = [{Path('RJ123')}, set(), KeyboardInterrupt]
+    with mock.patch('time.monotonic', side_effect=[0, 100, 100, 100]):
+        dlorg._watch(args, lambda: stub_fetcher, watcher)
+    assert (top_dir / 'RJ123').exists()
+
+
+def test__watch_retries_errors(tmpdir, stub_fetcher, monkeypatch):
+    tmpdir.ensure('RJ123', dir=True)
+    top_dir = Path(str(tmpdir))
+    args = dlorg._parse_args(['dlorg', '--watch', '--debounce', '0',
+                              str(top_dir)])
+    watcher = mock.Mock()
+    watcher.events.side_effect = [{Path('RJ123')}, set(), KeyboardInterrupt]
+    get_fetcher = mock.Mock(side_effect=[stub_fetcher, OSError('down'),
+                                         stub_fetcher])
+    monkeypatch.setattr(dlorg, '_RETRY_DELAY', 0)
+    dlorg._watch(args, get_fetcher, watcher)
+    assert os.listdir(str(tmpdir.join('group', 'series'))) == ['RJ123 name']
+
+
+def test_main_view(tmpdir, stub_fetcher):
+    tmpdir.ensure('top/RJ123', dir=True)
+    top_dir = Path(str(tmpdir), 'top')
+    view_dir = Path(str(tmpdir), 'view')
+    with mock.patch('mir.dlsite.api.get_fetcher') as get_fetcher:
+        get_fetcher.return_value = stub_fetcher
+        dlorg.main(['dlorg', '--view', str(view_dir), str(top_dir)])
+    assert os.listdir(str(top_dir)) == ['RJ123']
+    got = view_dir / 'group' / 'series' / 'RJ123 name'
+    assert os.readlink(got) == str(top_dir / 'RJ123')
+
+
+def test_main_layout(tmpdir, stub_fetcher):
+    tmpdir.ensure('RJ123/file')
+    with mock.patch('mir.dlsite.api.get_fetcher') as get_fetcher:
+        get_fetcher.return_value = stub_fetcher
+        dlorg.main(['dlorg', '-l', '{series}/{rjcode}', str(tmpdir)])
+    assert os.listdir(str(tmpdir.join('series'))) == ['RJ123']
+
+
+def test_main_progress(tmpdir, stub_fetcher, capsys):
+    tmpdir.ensure('RJ123/file')
+    with mock.patch('mir.dlsite.api.get_fetcher') as get_fetcher:
+        get_fetcher.return_value = stub_fetcher
+        dlorg.main(['dlorg', '--progress', 'text', str(tmpdir)])
+    out, err = capsys.readouterr()
+    assert 'dlorg: fetch: 1/1, ' in err
+    assert 'dlorg: rename: 1/1, ' in err
+    assert 'Renaming' not in err
+
+
+def test_main_multiple_roots(tmpdir, stub_fetcher):
+    tmpdir.ensure('a/RJ1/file')
+    tmpdir.ensure('b/RJ1/file')
+    tmpdir.ensure('b/RJ2/file')
+    a = Path(str(tmpdir), 'a')
+    b = Path(str(tmpdir), 'b')
+    with mock.patch('mir.dlsite.api.get_fetcher') as get_fetcher, \
+         mock.patch.object(stub_fetcher, 'fetch_many',
+                           wraps=stub_fetcher.fetch_many) as fetch_many:
+        get_fetcher.return_value = stub_fetcher
+        dlorg.main(['dlorg', str(a), str(b)])
+    assert sorted(fetch_many.call_args[0][0]) == ['RJ1', 'RJ1', 'RJ2']
+    assert fetch_many.call_count == 1
+    assert os.listdir(str(a / 'group' / 'series')) == ['RJ1 name']
+    assert sorted(os.listdir(str(b / 'group' / 'series'))) == [
+        'RJ1 name', 'RJ2 name']
+
+
+def test_main_lookup_error(tmpdir):
+    tmpdir.ensure('RJ1/file')
+    tmpdir.ensure('RJ2/file')
+
+    def fetch(rjcode):
+        if rjcode == 'RJ2':
+            raise ValueError('404 delisted')
+        work = workinfo.Work(rjcode, 'name', 'group')
+        work.series = 'series'
+        return work
+
+    fetcher = mock.MagicMock(side_effect=fetch)
+    fetcher.__enter__.return_value = fetcher
+    fetcher.__exit__.return_value = False
+    fetcher.fetch_many.side_effect = ValueError('404 delisted')
+    with mock.patch('mir.dlsite.api.get_fetcher') as get_fetcher:
+        get_fetcher.return_value = fetcher
+        dlorg.main(['dlorg', str(tmpdir)])
+    assert os.listdir(str(tmpdir.join('group', 'series'))) == ['RJ1 name']
+    assert tmpdir.join('RJ2', 'file').exists()
+
+
+def test_main_target_exists(tmpdir, stub_fetcher):
+    tmpdir.ensure('RJ1/file')
+    tmpdir.ensure('group/series/RJ1 name/other')
+    with mock.patch('mir.dlsite.api.get_fetcher') as get_fetcher:
+        get_fetcher.return_value = stub_fetcher
+        dlorg.main(['dlorg', str(tmpdir)])
+    assert (Path(str(tmpdir)) / 'RJ1' / 'file').exists()
+    assert os.listdir(str(tmpdir.join('group/series/RJ1 name'))) == ['other']
+
+
+def test_parse_args_overlapping_roots(tmpdir):
+    tmpdir.ensure('a/b', dir=True)
+    with pytest.raises(SystemExit):
+        dlorg._parse_args(['dlorg', str(tmpdir.join('a')),
+                           str(tmpdir.join('a/b'))])
+
+
+def test_parse_args_invalid_layout(tmpdir):
+    with pytest.raises(SystemExit):
+        dlorg._parse_args(['dlorg', '-l', '{maker}/{title}', str(tmpdir)])
@@ -0,0 +1,86 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from unittest import mock
+
+from mir.dlsite import api
+from mir.dlsite import cache
+from mir.dlsite.cmd import dlsited
+from mir.dlsite import daemon
+from mir.dlsite import workinfo
+
+
+def _fetch(rjcode, resolver=None, memo=None):
+    return workinfo.Work(rjcode, 'name', 'maker')
+
+
+def _run(sock, cache_path, client):
+    """Run dlsited with client called in a thread while it serves."""
+    serve_forever = daemon.Server.serve_forever
+    errors = []
+
+    def serve(server):
+        def run_client():
+            try:
+                client()
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                server.shutdown()
+        thread = threading.Thread(target=run_client)
+        thread.start()
+        serve_forever(server, poll_interval=0.05)
+        thread.join()
+
+    with mock.patch('mir.dlsite.api.get_fetcher',
+                    lambda: api.CachedFetcher(cache_path, _fetch)), \
+         mock.patch.object(daemon.Server, 'serve_forever', serve), \
+         mock.patch('signal.signal'):
+        dlsited.main(['dlsited', '-s', str(sock)])
+    if errors:
+        raise errors[0]
+
+
+def test_dlsited(tmp_path):
+    sock = tmp_path / 'sock'
+    got = []
+
+    def client():
+        with daemon.RemoteFetcher(daemon._connect(sock)) as fetcher:
+            got.append(fetcher('RJ1'))
+            got.extend(fetcher.fetch_many(['RJ2']).values())
+
+    _run(sock, tmp_path / 'cache', client)
+    assert [w.rjcode for w in got] == ['RJ1', 'RJ2']
+    assert not sock.exists()
+
+
+def test_dlsited_does_not_lock_cache_between_requests(tmp_path):
+    sock = tmp_path / 'sock'
+    cache_path = tmp_path / 'cache'
+
+    def client():
+        with daemon.RemoteFetcher(daemon._connect(sock)) as fetcher:
+            fetcher('RJ1')
+            with cache.lock(cache_path, blocking=False):
+                pass
+            with api.CachedFetcher(cache_path, _fetch) as local:
+                local('RJ2')
+            fetcher('RJ3')
+
+    _run(sock, cache_path, client)
+    with api.CachedFetcher(cache_path, None) as fetcher:
+        assert [fetcher(c).rjcode for c in ('RJ1', 'RJ2', 'RJ3')] == [
+            'RJ1', 'RJ2', 'RJ3']
@@ -0,0 +1,142 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from mir.dlsite import api
+from mir.dlsite import cache
+from mir.dlsite import dupes
+from mir.dlsite.cmd import dldupes
+
+
+def _make_work(path: Path, files: 'Dict[str, str]'):
+    for name, text in files.items():
+        (path / name).parent.mkdir(parents=True, exist_ok=True)
+        (path / name).write_text(text)
+
+
+def test_group_by_rjcode(tmp_path):
+    paths = [tmp_path / 'a' / 'RJ1 foo', tmp_path / 'b' / 'RJ1',
+             tmp_path / 'a' / 'RJ2']
+    for p in paths:
+        p.mkdir(parents=True)
+    got = dupes.group_by_rjcode(paths)
+    assert got == {'RJ1': paths[:2]}
+
+
+def test_find_duplicates(tmp_path):
+    _make_work(tmp_path / 'a', {'x': 'spam', 'sub/y': 'eggs'})
+    _make_work(tmp_path / 'b', {'x': 'spam', 'sub/y': 'eggs'})
+    _make_work(tmp_path / 'c', {'x': 'spam', 'sub/y': 'hams'})
+    _make_work(tmp_path / 'd', {'x': 'spam'})
+    group = [tmp_path / n for n in 'abcd']
+    hashes = {}
+    got = dupes.find_duplicates([group], hashes)
+    assert got == [[tmp_path / 'a', tmp_path / 'b']]
+    # d has different sizes, so it is never hashed.
+    assert len(hashes) == 6
+
+
+def test_group_by_rjcode_skips_links(tmp_path):
+    (tmp_path / 'RJ1').mkdir()
+    (tmp_path / 'view').mkdir()
+    (tmp_path / 'view' / 'RJ1').symlink_to(tmp_path / 'RJ1')
+    (tmp_path / 'other').mkdir()
+    (tmp_path / 'other' / 'RJ1').mkdir()
+    got = dupes.group_by_rjcode([
+        tmp_path / 'RJ1', tmp_path / 'view' / 'RJ1',
+        tmp_path / 'other' / '..' / 'RJ1', tmp_path / 'other' / 'RJ1'])
+    assert got == {'RJ1': [tmp_path / 'RJ1', tmp_path / 'other' / 'RJ1']}
+
+
+def test_find_duplicates_skips_hard_links(tmp_path):
+    _make_work(tmp_path / 'a', {'x': 'spam'})
+    (tmp_path / 'b').mkdir()
+    os.link(tmp_path / 'a' / 'x', tmp_path / 'b' / 'x')
+    hashes = {}
+    got = dupes.find_duplicates([[tmp_path / 'a', tmp_path / 'b']], hashes)
+    assert got == []
+    assert hashes == {}
+
+
+def test_find_duplicates_hash_error(tmp_path):
+    _make_work(tmp_path / 'a', {'x': 'spam'})
+    _make_work(tmp_path / 'b', {'x': 'spam'})
+    _make_work(tmp_path / 'c', {'x': 'spam'})
+    group = [tmp_path / 'a', tmp_path / 'b', tmp_path / 'c']
+    real_hash_file = dupes._hash_file
+
+    def hash_file(path):
+        if path.startswith(str(tmp_path / 'a')):
+            raise PermissionError(path)
+        return real_hash_file(path)
+
+    with mock.patch.object(dupes, '_hash_file', hash_file):
+        got = dupes.find_duplicates([group], {})
+    assert got == [[tmp_path / 'b', tmp_path / 'c']]
+
+
+def test_find_duplicates_reuses_hashes(tmp_path):
+    _make_work(tmp_path / 'a', {'x': 'spam'})
+    _make_work(tmp_path / 'b', {'x': 'spam'})
+    group = [tmp_path / 'a', tmp_path / 'b']
+    hashes = {}
+    dupes.find_duplicates([group], hashes)
+    with mock.patch.object(dupes, '_hash_file') as hash_file:
+        got = dupes.find_duplicates([group], hashes)
+    hash_file.assert_not_called()
+    assert got == [group]
+
+
+def test_dldupes(tmp_path, capsys, stub_fetcher):
+    _make_work(tmp_path / 'disk1' / 'RJ1 foo', {'x': 'spam'})
+    _make_work(tmp_path / 'disk2' / 'maker' / 'RJ1', {'x': 'spam'})
+    _make_work(tmp_path / 'disk2' / 'RJ2', {'x': 'spam'})
+    with mock.patch('mir.dlsite.api.get_fetcher') as get_fetcher:
+        get_fetcher.return_value = stub_fetcher
+        assert dldupes.main(['dldupes', str(tmp_path / 'disk1'),
+                             str(tmp_path / 'disk2')]) == 0
+    out, err = capsys.readouterr()
+    assert out == (f'{tmp_path}/disk1/RJ1 foo\n'
+                   f'{tmp_path}/disk2/maker/RJ1\n')
+    assert len(stub_fetcher.meta('datahash')) == 2
+
+
+def test_dldupes_does_not_lock_cache_while_hashing(tmp_path, capsys):
+    _make_work(tmp_path / 'disk1' / 'RJ1', {'x': 'spam'})
+    _make_work(tmp_path / 'disk2' / 'RJ1', {'x': 'spam'})
+    cache_path = tmp_path / 'cache'
+    hash_file = dupes._hash_file
+
+    def locked_hash_file(path):
+        with cache.lock(cache_path, shared=True, blocking=False):
+            return hash_file(path)
+
+    with mock.patch('mir.dlsite.api.get_fetcher',
+                    lambda: api.CachedFetcher(cache_path, None)), \
+         mock.patch.object(dupes, '_hash_file', locked_hash_file):
+        assert dldupes.main(['dldupes', str(tmp_path / 'disk1'),
+                             str(tmp_path / 'disk2')]) == 0
+    with api.CachedFetcher(cache_path, None) as fetcher:
+        assert len(fetcher.meta('datahash')) == 2
+
+
+def test_dldupes_overlapping_roots(tmp_path):
+    (tmp_path / 'disk').mkdir()
+    with pytest.raises(SystemExit):
+        dldupes.main(['dldupes', str(tmp_path / 'disk'), str(tmp_path)])
@@ -0,0 +1,87 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+
+from mir.dlsite import api
+from mir.dlsite.workinfo import AgeRating
+from tests.fakesite import FakeSite
+from tests.fakesite import synthetic_work
+
+
+def test_synthetic_work_pages():
+    with FakeSite(synthetic=3) as site:
+        resolver = api.URLResolver(root=site.root)
+        for rjcode in site.synthetic_rjcodes():
+            work = api.fetch_work(rjcode, resolver)
+            want = synthetic_work(rjcode)
+            assert work.name == want['name']
+            assert work.maker == want['maker']
+            assert work.series == want['series']
+            assert work.age == AgeRating(want['age_category'] - 1)
+
+
+def test_synthetic_announce_pages():
+    with FakeSite(synthetic=20, announce_rate=0.5, seed=1) as site:
+        announce = [c for c in site.synthetic_rjcodes() if site.is_announce(c)]
+        assert 0 < len(announce) < 20
+        hints = {}
+        for rjcode in site.synthetic_rjcodes():
+            api.fetch_work(rjcode, api.URLResolver(hints, root=site.root))
+    assert sorted(c for c, v in hints.items() if v == 'announce') == announce
+
+
+def test_error_rate_is_deterministic():
+    results = []
+    for _ in range(2):
+        with FakeSite(synthetic=10, error_rate=0.5, seed=3) as site:
+            resolver = api.URLResolver(root=site.root)
+            failed = []
+            for rjcode in site.synthetic_rjcodes():
+                try:
+                    api.fetch_work(rjcode, resolver)
+                except urllib.error.HTTPError as e:
+                    assert e.code == 503
+                    failed.append(rjcode)
+            results.append(failed)
+    assert results[0] == results[1]
+    assert results[0]
+
+
+def test_fetch_many_is_concurrent(tmp_path, monkeypatch):
+    with FakeSite(synthetic=16, latency=0.2) as site:
+        monkeypatch.setattr(api, '_ROOT', site.root)
+        with api.CachedFetcher(tmp_path / 'cache', api.fetch_work) as fetcher:
+            start = time.monotonic()
+            works = fetcher.fetch_many(site.synthetic_rjcodes(),
+                                       max_workers=16)
+            elapsed = time.monotonic() - start
+    assert len(works) == 16
+    # Serially this would take at least 16 * 0.2 seconds.
+    assert elapsed < 16 * 0.2 / 2
+
+
+def test_root_from_environment():
+    with FakeSite(synthetic=1) as site:
+        rjcode = site.synthetic_rjcodes()[0]
+        code = f'from mir.dlsite import api; print(api.fetch_work({rjcode!r}).name)'
+        env = dict(os.environ, MIR_DLSITE_ROOT=site.root)
+        got = subprocess.run([sys.executable, '-c', code], check=True,
+                             capture_output=True, text=True,
+                             env=env).stdout
+    assert got == synthetic_work(rjcode)['name'] + '\n'
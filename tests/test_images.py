@@ -0,0 +1,104 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import http.client
+import os
+from unittest import mock
+
+from mir.dlsite import images
+from mir.dlsite import workinfo
+
+
+def _make_works(fake_site):
+    fake_site.files['/img/main1.jpg'] = b'main one'
+    fake_site.files['/img/main2.jpg'] = b'main two'
+    fake_site.files['/img/shared.jpg'] = b'shared sample'
+    work1 = workinfo.Work('RJ1', 'name', 'maker')
+    work1.images = [fake_site.root + 'img/main1.jpg',
+                    fake_site.root + 'img/shared.jpg']
+    work2 = workinfo.Work('RJ2', 'name', 'maker')
+    work2.images = [fake_site.root + 'img/main2.jpg',
+                    fake_site.root + 'img/shared.jpg']
+    return [work1, work2]
+
+
+def test_image_store_download(tmp_path, fake_site):
+    works = _make_works(fake_site)
+    with images.ImageStore(tmp_path) as store:
+        assert store.download(works) == 3
+    got = tmp_path / 'works' / 'RJ2' / 'shared.jpg'
+    assert got.read_bytes() == b'shared sample'
+    assert os.path.samefile(got, tmp_path / 'works' / 'RJ1' / 'shared.jpg')
+    assert len(list((tmp_path / 'objects').glob('*/*'))) == 3
+    assert len(fake_site.requests) == 3
+
+
+def test_image_store_skips_downloaded(tmp_path, fake_site):
+    works = _make_works(fake_site)
+    with images.ImageStore(tmp_path) as store:
+        store.download(works[:1])
+        fake_site.requests.clear()
+        assert store.download(works) == 1
+    assert fake_site.requests == ['/img/main2.jpg']
+
+
+def test_image_store_dedupes_identical_contents(tmp_path, fake_site):
+    fake_site.files['/a.jpg'] = b'same'
+    fake_site.files['/b.jpg'] = b'same'
+    work = workinfo.Work('RJ1', 'name', 'maker')
+    work.images = [fake_site.root + 'a.jpg', fake_site.root + 'b.jpg']
+    with images.ImageStore(tmp_path) as store:
+        store.download([work])
+    assert len(list((tmp_path / 'objects').glob('*/*'))) == 1
+
+
+def test_image_store_resumes(tmp_path, fake_site):
+    works = _make_works(fake_site)
+    url = fake_site.root + 'img/main1.jpg'
+    partial = tmp_path / 'partial' / hashlib.sha256(url.encode()).hexdigest()
+    partial.parent.mkdir()
+    partial.write_bytes(b'main')
+    with images.ImageStore(tmp_path) as store:
+        store.download(works[:1])
+    got = tmp_path / 'works' / 'RJ1' / 'main1.jpg'
+    assert got.read_bytes() == b'main one'
+    assert not partial.exists()
+
+
+def test_image_store_refetches_missing_objects(tmp_path, fake_site):
+    works = _make_works(fake_site)
+    with images.ImageStore(tmp_path) as store:
+        store.download(works[:1])
+        for obj in (tmp_path / 'objects').glob('*/*'):
+            obj.unlink()
+        assert store.download(works) == 2
+    got = tmp_path / 'works' / 'RJ2' / 'shared.jpg'
+    assert got.read_bytes() == b'shared sample'
+
+
+def test_image_store_skips_incomplete_reads(tmp_path, fake_site):
+    works = _make_works(fake_site)
+    download = images._download
+
+    def fake_download(url, path):
+        if url.endswith('main1.jpg'):
+            raise http.client.IncompleteRead(b'main')
+        download(url, path)
+
+    with images.ImageStore(tmp_path) as store, \
+         mock.patch.object(images, '_download', fake_download):
+        assert store.download(works) == 2
+    assert not (tmp_path / 'works' / 'RJ1' / 'main1.jpg').exists()
+    assert (tmp_path / 'works' / 'RJ2' / 'main2.jpg').exists()
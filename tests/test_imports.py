@@ -0,0 +1,38 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+import sys
+
+import pytest
+
+_HEAVY_MODULES = ['bs4', 'lxml', 'shelve', 'urllib.request']
+
+
+@pytest.mark.parametrize('module', [
+    'mir.dlsite.api',
+    'mir.dlsite.cmd.dldupes',
+    'mir.dlsite.cmd.dllist',
+    'mir.dlsite.cmd.dlmv',
+    'mir.dlsite.cmd.dlorg',
+])
+def test_import_is_lazy(module):
+    code = f'''\
+import sys
+import {module}
+print(' '.join(m for m in {_HEAVY_MODULES!r} if m in sys.modules))
+'''
+    got = subprocess.run([sys.executable, '-c', code], check=True,
+                         capture_output=True, text=True).stdout
+    assert got.split() == []
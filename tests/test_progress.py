@@ -0,0 +1,91 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+
+from mir.dlsite import progress
+
+
+class _Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_progress_snapshot():
+    clock = _Clock()
+    p = progress.Progress(total=10, clock=clock)
+    p.cache_hit(3)
+    p.cache_miss(1)
+    p.fetch_started()
+    p.processed(4)
+    clock.now = 2
+    got = p.snapshot()
+    assert got == progress.Snapshot(
+        processed=4, total=10, elapsed=2, rate=2, cache_hits=3,
+        cache_misses=1, in_flight=1, eta=3)
+    assert got.hit_ratio == 0.75
+
+
+def test_progress_reports_per_interval():
+    clock = _Clock()
+    reports = []
+    p = progress.Progress(reports.append, interval=1, clock=clock)
+    p.processed()
+    clock.now = 1
+    p.processed()
+    p.processed()
+    p.close()
+    assert [s.processed for s in reports] == [2, 3]
+
+
+def test_progress_phases():
+    clock = _Clock()
+    reports = []
+    p = progress.Progress(reports.append, total=2, clock=clock, phase='a')
+    p.cache_hit()
+    p.processed(2)
+    clock.now = 1
+    p.start_phase('b', total=5)
+    p.processed()
+    p.close()
+    assert [(s.phase, s.processed, s.total, s.cache_hits)
+            for s in reports] == [('a', 2, 2, 1), ('b', 1, 5, 1)]
+
+
+def test_text_reporter():
+    f = io.StringIO()
+    report = progress.text_reporter('dlorg', f)
+    report(progress.Snapshot(
+        processed=4, total=10, elapsed=2, rate=2, cache_hits=3,
+        cache_misses=1, in_flight=1, eta=3))
+    assert f.getvalue() == (
+        'dlorg: 4/10, 2.0/s, cache 75% hits, 1 fetching, ETA 3s\n')
+
+
+def test_json_reporter():
+    f = io.StringIO()
+    report = progress.json_reporter(f)
+    report(progress.Snapshot(
+        processed=4, total=None, elapsed=2, rate=2, cache_hits=0,
+        cache_misses=0, in_flight=0, eta=None))
+    assert json.loads(f.getvalue()) == {
+        'processed': 4, 'total': None, 'elapsed': 2, 'rate': 2,
+        'cache_hits': 0, 'cache_misses': 0, 'in_flight': 0, 'eta': None,
+        'phase': None, 'hit_ratio': None,
+    }
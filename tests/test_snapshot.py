@@ -0,0 +1,98 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+from unittest import mock
+
+import pytest
+
+from mir.dlsite import api
+from mir.dlsite import progress
+from mir.dlsite import snapshot
+from mir.dlsite import workinfo
+from mir.dlsite.cmd import dlcache
+from mir.dlsite.cmd import dllist
+
+
+def _fetch(rjcode, resolver=None, memo=None):
+    work = workinfo.Work(rjcode, f'name {rjcode}', 'maker')
+    if memo is not None:
+        memo[rjcode] = 'hash', work
+    return work
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    cache_path = tmp_path / 'cache'
+    with api.CachedFetcher(cache_path, _fetch) as fetcher:
+        fetcher.fetch_many(['RJ3', 'RJ10', 'RJ1', 'RJ200'])
+    path = tmp_path / 'snapshot'
+    assert snapshot.write_snapshot(cache_path, path) == 4
+    return path
+
+
+def test_snapshot(snapshot_path):
+    with snapshot.Snapshot(snapshot_path) as snap:
+        assert len(snap) == 4
+        assert list(snap) == ['RJ1', 'RJ10', 'RJ200', 'RJ3']
+        assert snap['RJ10'] == workinfo.Work('RJ10', 'name RJ10', 'maker')
+        assert 'RJ3' in snap
+        assert 'RJ2' not in snap
+        assert 'RJ100' not in snap
+        with pytest.raises(KeyError):
+            snap['RJ4']
+
+
+def test_snapshot_not_a_snapshot(tmp_path):
+    path = tmp_path / 'bad'
+    path.write_bytes(b'x' * 100)
+    with pytest.raises(ValueError):
+        snapshot.Snapshot(path).__enter__()
+
+
+def test_snapshot_fetcher(snapshot_path):
+    with snapshot.SnapshotFetcher(snapshot_path) as fetcher:
+        assert fetcher('RJ1').name == 'name RJ1'
+        with pytest.raises(KeyError):
+            fetcher('RJ4')
+
+
+def test_snapshot_fetcher_fetch_many(snapshot_path):
+    fetch = mock.Mock(side_effect=_fetch)
+    p = progress.Progress()
+    with snapshot.SnapshotFetcher(snapshot_path, fetch) as fetcher:
+        got = fetcher.fetch_many(['RJ1', 'RJ4'], progress=p)
+    assert sorted(got) == ['RJ1', 'RJ4']
+    fetch.assert_called_once_with('RJ4')
+    s = p.snapshot()
+    assert (s.processed, s.cache_hits, s.cache_misses) == (2, 1, 1)
+
+
+def test_dlcache_snapshot(tmp_path, capsys):
+    cache_path = tmp_path / 'cache'
+    with api.CachedFetcher(cache_path, _fetch) as fetcher:
+        fetcher('RJ1')
+    out = tmp_path / 'snapshot'
+    assert dlcache.main(['dlcache', '--cache', str(cache_path),
+                         'snapshot', str(out)]) == 0
+    with snapshot.Snapshot(out) as snap:
+        assert list(snap) == ['RJ1']
+
+
+def test_dllist_snapshot(snapshot_path, capsys):
+    with mock.patch('sys.argv', ['dllist', '--snapshot', str(snapshot_path)]), \
+         mock.patch('sys.stdin', io.StringIO('RJ200\nRJ1\n')):
+        dllist.main()
+    out, err = capsys.readouterr()
+    assert out == 'RJ200 [maker] name RJ200\nRJ1 [maker] name RJ1\n'
@@ -0,0 +1,140 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from pathlib import Path
+
+import pytest
+
+from mir.dlsite import progress
+from mir.dlsite import view
+
+
+@pytest.fixture
+def works(tmp_path):
+    for name in ('RJ1', 'RJ2'):
+        (tmp_path / 'src' / name / 'sub').mkdir(parents=True)
+        (tmp_path / 'src' / name / 'sub' / 'file').write_text(name)
+    return tmp_path / 'src'
+
+
+def test_update_view_symlinks(tmp_path, works):
+    v = tmp_path / 'view'
+    stats = view.update_view(v, {Path('a/RJ1 x'): works / 'RJ1'})
+    assert stats == view.Stats(created=1)
+    assert (v / 'a' / 'RJ1 x' / 'sub' / 'file').read_text() == 'RJ1'
+    assert os.readlink(v / 'a' / 'RJ1 x') == str(works / 'RJ1')
+
+
+def test_update_view_progress(tmp_path, works):
+    p = progress.Progress()
+    view.update_view(tmp_path / 'view', {Path('RJ1'): works / 'RJ1',
+                                         Path('RJ2'): works / 'RJ2'},
+                     progress=p)
+    assert p.snapshot().processed == 2
+
+
+def test_update_view_incremental(tmp_path, works):
+    v = tmp_path / 'view'
+    view.update_view(v, {Path('a/RJ1 x'): works / 'RJ1',
+                         Path('a/RJ2 y'): works / 'RJ2'})
+    stats = view.update_view(v, {Path('a/RJ1 x'): works / 'RJ1',
+                                 Path('b/RJ2 y'): works / 'RJ2'})
+    assert stats == view.Stats(created=1, removed=1, unchanged=1)
+    assert sorted(os.listdir(v)) == ['.dlsite-view.json', 'a', 'b']
+    assert os.listdir(v / 'a') == ['RJ1 x']
+
+
+def test_update_view_no_prune(tmp_path, works):
+    v = tmp_path / 'view'
+    view.update_view(v, {Path('RJ1'): works / 'RJ1'})
+    view.update_view(v, {Path('RJ2'): works / 'RJ2'}, prune=False)
+    assert (v / 'RJ1').exists()
+    assert (v / 'RJ2').exists()
+
+
+def test_update_view_hardlinks(tmp_path, works):
+    v = tmp_path / 'view'
+    view.update_view(v, {Path('a/RJ1 x'): works / 'RJ1'}, mode=view.HARDLINK)
+    got = v / 'a' / 'RJ1 x' / 'sub' / 'file'
+    assert not got.is_symlink()
+    assert os.path.samefile(got, works / 'RJ1' / 'sub' / 'file')
+    view.update_view(v, {}, mode=view.HARDLINK)
+    assert os.listdir(v) == ['.dlsite-view.json']
+    assert (works / 'RJ1' / 'sub' / 'file').exists()
+
+
+def test_update_view_mode_mismatch(tmp_path, works):
+    v = tmp_path / 'view'
+    view.update_view(v, {Path('RJ1'): works / 'RJ1'})
+    with pytest.raises(ValueError):
+        view.update_view(v, {}, mode=view.HARDLINK)
+
+
+def test_update_view_adopts_unrecorded_links(tmp_path, works):
+    v = tmp_path / 'view'
+    v.mkdir()
+    (v / 'RJ1').symlink_to(works / 'RJ1')
+    stats = view.update_view(v, {Path('RJ1'): works / 'RJ1'})
+    assert stats == view.Stats(unchanged=1)
+    view.update_view(v, {})
+    assert not (v / 'RJ1').exists()
+
+
+def test_update_view_adopts_unrecorded_hardlinks(tmp_path, works):
+    v = tmp_path / 'view'
+    view.update_view(v, {Path('RJ1'): works / 'RJ1'}, mode=view.HARDLINK)
+    (v / '.dlsite-view.json').unlink()
+    stats = view.update_view(v, {Path('RJ1'): works / 'RJ1'},
+                             mode=view.HARDLINK)
+    assert stats == view.Stats(unchanged=1)
+
+
+def test_update_view_skips_other_files(tmp_path, works):
+    v = tmp_path / 'view'
+    (v / 'RJ1').mkdir(parents=True)
+    stats = view.update_view(v, {Path('RJ1'): works / 'RJ1'})
+    assert stats == view.Stats()
+    view.update_view(v, {})
+    assert (v / 'RJ1').is_dir()
+
+
+def test_update_view_saves_manifest_on_error(tmp_path, works, monkeypatch):
+    v = tmp_path / 'view'
+    make_link = view._make_link
+
+    def fake_make_link(link, target, mode):
+        if target.name == 'RJ2':
+            raise OSError('link failed')
+        make_link(link, target, mode)
+
+    monkeypatch.setattr(view, '_make_link', fake_make_link)
+    with pytest.raises(OSError):
+        view.update_view(v, {Path('RJ1'): works / 'RJ1',
+                             Path('RJ2'): works / 'RJ2'})
+    monkeypatch.setattr(view, '_make_link', make_link)
+    stats = view.update_view(v, {Path('RJ1'): works / 'RJ1',
+                                 Path('RJ2'): works / 'RJ2'})
+    assert stats == view.Stats(created=1, unchanged=1)
+
+
+def test_make_link_removes_partial_copy(tmp_path, works, monkeypatch):
+    def link(src, dst):
+        raise OSError(18, 'Invalid cross-device link')
+
+    monkeypatch.setattr(os, 'link', link)
+    with pytest.raises(OSError):
+        view._make_link(tmp_path / 'view' / 'RJ1', works / 'RJ1',
+                        view.HARDLINK)
+    assert not (tmp_path / 'view' / 'RJ1').exists()
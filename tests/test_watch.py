@@ -0,0 +1,102 @@
+# Copyright (C) 2021 Allen Li
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import os
+from pathlib import Path
+import sys
+import time
+from unittest import mock
+
+import pytest
+
+from mir.dlsite import watch
+
+
+def test_debouncer():
+    d = watch.Debouncer(5)
+    assert d.add(Path('RJ1'), 0)
+    assert not d.add(Path('RJ1'), 3)
+    assert d.ready(6) == []
+    assert d.ready(8) == [Path('RJ1')]
+    assert d.ready(20) == []
+
+
+def test_polling_watcher(tmp_path):
+    (tmp_path / 'RJ1').mkdir()
+    with watch.PollingWatcher(tmp_path, interval=0) as watcher:
+        (tmp_path / 'RJ2').mkdir()
+        (tmp_path / 'other').mkdir()
+        assert watcher.events(timeout=0) == {Path('RJ2')}
+        assert watcher.events(timeout=0) == set()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='inotify is Linux only')
+def test_inotify_watcher(tmp_path):
+    (tmp_path / 'RJ1').mkdir()
+    with watch.InotifyWatcher(tmp_path) as watcher:
+        (tmp_path / 'RJ2').mkdir()
+        (tmp_path / 'other').mkdir()
+        assert watcher.events(timeout=1) == {Path('RJ2')}
+        (tmp_path / 'RJ1' / 'file').write_text('foo')
+        assert watcher.events(timeout=1) == {Path('RJ1')}
+        (tmp_path / 'other' / 'RJ3').mkdir()
+        assert watcher.events(timeout=0.1) == set()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='inotify is Linux only')
+def test_inotify_watcher_work_subdirs(tmp_path):
+    (tmp_path / 'RJ1' / 'disc1').mkdir(parents=True)
+    with watch.InotifyWatcher(tmp_path) as watcher:
+        (tmp_path / 'RJ1' / 'disc1' / 'file').write_text('foo')
+        assert watcher.events(timeout=1) == {Path('RJ1')}
+        (tmp_path / 'RJ1' / 'disc2').mkdir()
+        watcher.events(timeout=1)
+        (tmp_path / 'RJ1' / 'disc2' / 'file').write_text('foo')
+        assert watcher.events(timeout=1) == {Path('RJ1')}
+
+
+def test_recently_modified(tmp_path):
+    (tmp_path / 'RJ1' / 'sub').mkdir(parents=True)
+    (tmp_path / 'RJ1' / 'sub' / 'file').write_text('foo')
+    old = time.time() - 100
+    os.utime(tmp_path / 'RJ1', (old, old))
+    os.utime(tmp_path / 'RJ1' / 'sub', (old, old))
+    assert watch.recently_modified(tmp_path / 'RJ1', 10)
+    os.utime(tmp_path / 'RJ1' / 'sub' / 'file', (old, old))
+    assert not watch.recently_modified(tmp_path / 'RJ1', 10)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='inotify is Linux only')
+def test_inotify_watcher_recursive(tmp_path):
+    with watch.InotifyWatcher(tmp_path, recursive=True) as watcher:
+        (tmp_path / 'maker').mkdir()
+        watcher.events(timeout=1)
+        (tmp_path / 'maker' / 'RJ3').mkdir()
+        assert watcher.events(timeout=1) == {Path('maker/RJ3')}
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='inotify is Linux only')
+def test_inotify_watcher_watch_limit(tmp_path, caplog):
+    (tmp_path / 'RJ1').mkdir()
+    with watch.InotifyWatcher(tmp_path) as watcher, \
+         mock.patch.object(watcher, '_libc') as libc, \
+         mock.patch('ctypes.get_errno', return_value=errno.ENOSPC):
+        libc.inotify_add_watch.return_value = -1
+        watcher._add_watch(Path('RJ1'), watch._WORK_MASK, Path('RJ1'))
+    assert 'max_user_watches' in caplog.text
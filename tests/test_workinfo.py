@@ -12,7 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
 from pathlib import Path
+from unittest import mock
 
 import pytest
 
@@ -23,6 +25,17 @@ def test_parse_rjcode():
     assert workinfo.parse_rjcode('asdf RJ123 asdf') == 'RJ123'
 
 
+def test_parse_rjcode_other_stores():
+    assert workinfo.parse_rjcode('asdf VJ123 asdf') == 'VJ123'
+    assert workinfo.parse_rjcode('RE1') == 'RE1'
+    assert workinfo.parse_rjcode('BJ1') == 'BJ1'
+
+
+def test_parse_rjcode_not_inside_words():
+    assert workinfo.parse_rjcode('MIXTURE1 RJ123456.zip') == 'RJ123456'
+    assert workinfo.parse_rjcode('foo_RJ1') == 'RJ1'
+
+
 def test_parse_rjcode_when_missing():
     with pytest.raises(ValueError):
         workinfo.parse_rjcode('asdf')
@@ -36,6 +49,50 @@ def test_contains_rjcode_missing():
     assert not workinfo.contains_rjcode('asdf')
 
 
+def test_contains_rjcode_inside_word():
+    assert not workinfo.contains_rjcode('SCORE2019')
+
+
+def test_find_rjcodes():
+    got = list(workinfo.find_rjcodes('RJ1 foo RJ22\nbar'))
+    assert got == [(0, 'RJ1'), (8, 'RJ22')]
+
+
+def test_find_rjcodes_all_stores():
+    got = list(workinfo.find_rjcodes('VJ1 SCORE2019 BJ2'))
+    assert got == [(0, 'VJ1'), (14, 'BJ2')]
+
+
+def test_find_rjcodes_bytes_options():
+    got = list(workinfo.find_rjcodes(b'rj1 RJ2\nx VJ3\n',
+                                     prefixes=['RJ', 'VJ'],
+                                     ignore_case=True,
+                                     first_per_line=True))
+    assert got == [(0, 'RJ1'), (10, 'VJ3')]
+
+
+def test_scan_rjcodes_file_mmap(tmp_path):
+    path = tmp_path / 'list'
+    path.write_bytes(b'foo RJ1\nRJ2 bar\n')
+    with path.open('rb') as f:
+        got = list(workinfo.scan_rjcodes_file(f))
+    assert got == [(4, 'RJ1'), (8, 'RJ2')]
+
+
+def test_scan_rjcodes_file_chunks():
+    f = io.BytesIO(b'foo RJ1\nRJ2 bar\nRJ345')
+    got = list(workinfo.scan_rjcodes_file(f, chunk_size=5))
+    assert got == [(4, 'RJ1'), (8, 'RJ2'), (16, 'RJ345')]
+
+
+def test_scan_rjcodes_file_does_not_wait_for_full_chunk():
+    f = mock.Mock()
+    f.fileno.side_effect = io.UnsupportedOperation
+    f.read1.side_effect = [b'RJ1\n', AssertionError('read too far')]
+    got = workinfo.scan_rjcodes_file(f)
+    assert next(got) == (0, 'RJ1')
+
+
 def test_work_repr():
     work = workinfo.Work('RJ123', 'foo', 'bar')
     got = repr(work)
@@ -71,6 +128,64 @@ def test_work_path_slash():
     assert workinfo.work_path(obj) == Path('bar_/RJ123 foo')
 
 
+def test_genre_path():
+    obj = workinfo.Work('RJ123', 'foo', 'bar')
+    obj.genres = ['baz/', 'spam']
+    assert workinfo.genre_path(obj) == Path('baz_/bar/RJ123 foo')
+
+
+def test_age_path():
+    obj = workinfo.Work('RJ123', 'foo', 'bar')
+    obj.age = workinfo.AgeRating.R15
+    assert workinfo.age_path(obj) == Path('R15/bar/RJ123 foo')
+
+
+def test_template_layout():
+    layout = workinfo.get_layout('{age}/{series}/{rjcode} [{maker}] {name}')
+    obj = workinfo.Work('RJ123', 'foo/', 'bar')
+    obj.age = workinfo.AgeRating.R18
+    assert layout(obj) == Path('R18/RJ123 [bar] foo_')
+
+
+def test_get_layout_unknown():
+    with pytest.raises(ValueError):
+        workinfo.get_layout('spam')
+
+
+@pytest.mark.parametrize('template', [
+    '{maker}/{title}',
+    '{maker}/{}',
+    '{maker.upper}',
+    '{maker',
+    '../{maker}',
+    '{maker}/./{rjcode}',
+])
+def test_template_layout_invalid(template):
+    with pytest.raises(ValueError):
+        workinfo.get_layout(template)
+
+
+def test_template_layout_dot_fields():
+    layout = workinfo.get_layout('{series}/{maker}/{rjcode}')
+    obj = workinfo.Work('RJ123', 'foo', '..')
+    obj.series = '.'
+    assert layout(obj) == Path('_/__/RJ123')
+
+
+def test_plan_layout():
+    works = {
+        Path('a/RJ1'): workinfo.Work('RJ1', 'foo', 'bar'),
+        Path('RJ2'): workinfo.Work('RJ2', 'foo', 'bar'),
+        Path('b/RJ1'): workinfo.Work('RJ1', 'foo', 'bar'),
+    }
+    plan, collisions = workinfo.plan_layout(works)
+    assert plan == {
+        Path('a/RJ1'): Path('bar/RJ1 foo'),
+        Path('RJ2'): Path('bar/RJ2 foo'),
+    }
+    assert collisions == {Path('bar/RJ1 foo'): [Path('a/RJ1'), Path('b/RJ1')]}
+
+
 def test_track_eq():
     track1 = workinfo.Track('lydie', 'suelle')
     track2 = workinfo.Track('lydie', 'suelle')